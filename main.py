@@ -5,18 +5,45 @@ Material Data Aggregation Script
 Version: 1.0.0 
 """
 
+import numpy as np
 import pandas as pd
 import logging
+import os
 from pathlib import Path
-from typing import Dict, Optional, Tuple
-from openpyxl import load_workbook
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pandas.io.parsers import TextParser
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment
 import sys
 from datetime import datetime
 import warnings
+import copy
+import hashlib
+import operator
+import sqlite3
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    # Optional: parsed input cache and CSV/Parquet/Arrow inputs
+    import pyarrow
+    from pyarrow import feather, ipc, parquet
+except ImportError:
+    pyarrow = feather = ipc = parquet = None
 
 warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')
 
+# Copy-on-write lets shallow copies and derived frames share column data
+# until one side is modified. Always on from pandas 3.0; opt in before that.
+if int(pd.__version__.split('.')[0]) < 3:
+    try:
+        pd.set_option('mode.copy_on_write', True)
+    except pd.errors.OptionError:
+        pass
+
 # ============================================================================
 # Configuration
 # ============================================================================
@@ -28,6 +55,52 @@ class Config:
     OUTPUT_FOLDER = "output"
     LOG_FOLDER = "logs"
     OUTPUT_FILENAME = "result.xlsx"
+
+    # Number of processes used to parse input files (1 = sequential,
+    # None = one per input file, at most one per CPU)
+    LOAD_WORKERS = None
+
+    # Number of threads checking source tables concurrently (1 = sequential)
+    VALIDATION_WORKERS = 4
+
+    # Number of Plant partitions joined in parallel processes (1 = in-process)
+    AGGREGATION_WORKERS = 1
+
+    # 'pandas' joins in memory; 'sqlite' stages all tables in an on-disk
+    # SQLite database and streams the joined result (bounded memory)
+    AGGREGATION_BACKEND = 'pandas'
+    SQLITE_DATABASE = "staging/aggregation.sqlite"
+
+    # Rows per batch when streaming large inputs
+    STREAM_BATCH_SIZE = 50000
+
+    # Stream storage through the joins in STREAM_BATCH_SIZE chunks instead
+    # of loading it whole; memory then depends on the dimension tables
+    CHUNKED_AGGREGATION = False
+
+    # Keep the inputs and result of each run in STATE_FOLDER and only
+    # recompute output rows affected by changed input rows
+    INCREMENTAL_AGGREGATION = False
+    STATE_FOLDER = ".state"
+
+    # Log the optimized aggregation plan (LazyAggregation.explain) first
+    EXPLAIN_PLAN = False
+
+    # Log the peak traced memory of every pipeline step (slows the run)
+    TRACK_MEMORY = False
+
+    # Spill files of the cross-chunk duplicate check in streaming modes
+    SPILL_FOLDER = "staging/spill"
+    SPILL_PARTITIONS = 64
+
+    # Check FINAL_GRAIN uniqueness of an in-memory result with a Bloom filter
+    # and an exact check of its candidates only (for very large results)
+    BLOOM_GRAIN_CHECK = False
+    BLOOM_BITS_PER_KEY = 10
+
+    # Cache of parsed inputs (requires pyarrow), capped in size
+    CACHE_FOLDER = ".cache"
+    CACHE_MAX_BYTES = 512 * 1024 * 1024
     
     INPUT_FILES = {
         'materials': 'materials.xlsx',
@@ -37,6 +110,38 @@ class Config:
         'supplier_names': 'supplier-names.xlsx',
         'manufacturer_names': 'manufacturer-names.xlsx'
     }
+
+    # Typed columns per input table. Values are cast to `dtype` when the
+    # file is read; `pad` zero-fills the key to a fixed width in the output.
+    # 'str' columns are text even where cells hold numbers, so streamed
+    # batches read like a full load. Other columns are trimmed if parsed
+    # as text.
+    INPUT_SCHEMAS = {
+        'materials': {
+            'ManufacturerID': {'dtype': 'Int32'}
+        },
+        'plants': {
+            'Plant': {'dtype': 'Int16', 'pad': 4},
+            'ReporderPoint': {'dtype': 'Int64'}
+        },
+        'storage': {
+            'MaterialReference': {'dtype': 'str'},
+            'Plant': {'dtype': 'Int16', 'pad': 4},
+            'StorageLocation': {'dtype': 'str'},
+            'StorageBin': {'dtype': 'str'},
+            'DeletedStorageLevel': {'dtype': 'str'}
+        },
+        'suppliers': {
+            'SupplierID': {'dtype': 'Int32'},
+            'SupplierArticleNumber': {'dtype': 'Int64'}
+        },
+        'supplier_names': {
+            'SupplierID': {'dtype': 'Int32'}
+        },
+        'manufacturer_names': {
+            'ManufacturerID': {'dtype': 'Int32'}
+        }
+    }
     
     OUTPUT_COLUMNS = [
         'MaterialReference',
@@ -54,231 +159,2369 @@ class Config:
         'DeletedStorageLevel'
     ]
 
-# ============================================================================
-# Logging Setup
-# ============================================================================
+# ============================================================================
+# Logging Setup
+# ============================================================================
+
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    """
+    Configure logging to file and console.
+
+    Called from main() rather than at import, so processes that only import
+    this module (load workers under the spawn start method) do not create
+    log files of their own.
+    """
+    log_folder = Path(Config.LOG_FOLDER)
+    log_folder.mkdir(parents=True, exist_ok=True)
+    
+    log_file = log_folder / f"aggregation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    
+    logger.setLevel(logging.INFO)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+    
+    return logger
+
+# ============================================================================
+# Memory Accounting
+# ============================================================================
+
+# Highest traced memory seen so far inside each open memory_step
+_step_peaks: List[int] = []
+
+
+@contextmanager
+def memory_step(name: str):
+    """
+    Log the peak memory allocated while the block runs.
+
+    Active only while tracemalloc is tracing (Config.TRACK_MEMORY). Covers
+    numpy and Python allocations of this process (not of loader or
+    partition workers); Arrow buffers are reported as the change in
+    pyarrow's pool when pyarrow is installed. Steps may be nested.
+    """
+    if not tracemalloc.is_tracing():
+        yield
+        return
+
+    # reset_peak() below would lose the enclosing step's peak so far
+    start, peak = tracemalloc.get_traced_memory()
+    if _step_peaks:
+        _step_peaks[-1] = max(_step_peaks[-1], peak)
+    tracemalloc.reset_peak()
+    _step_peaks.append(start)
+    arrow_start = pyarrow.total_allocated_bytes() if pyarrow is not None else 0
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, _step_peaks.pop())
+        if _step_peaks:
+            _step_peaks[-1] = max(_step_peaks[-1], peak)
+        message = (f"  [memory] {name}: peak +{(peak - start) / 2**20:.1f} MB, "
+                   f"retained {(current - start) / 2**20:+.1f} MB")
+        if pyarrow is not None:
+            message += f", arrow {(pyarrow.total_allocated_bytes() - arrow_start) / 2**20:+.1f} MB"
+        logger.info(message)
+
+# ============================================================================
+# Input Formats
+# ============================================================================
+
+class ExcelFormat:
+    """Reads .xlsx files through openpyxl."""
+
+    @staticmethod
+    def read(file_path: Path, columns: Optional[frozenset]) -> pd.DataFrame:
+        usecols = columns.__contains__ if columns is not None else None
+        return pd.read_excel(file_path, engine='openpyxl', usecols=usecols)
+
+    @staticmethod
+    def iter_batches(file_path: Path, columns: Optional[frozenset], batch_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Stream the first sheet in batches of raw rows.
+
+        Uses openpyxl's read-only mode, which parses the sheet lazily, so only
+        one batch of plain row values is held in memory at a time instead of
+        the whole workbook object model.
+        """
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            # pd.read_excel reads the first sheet, whichever one is active
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+
+            # Positions of the projected columns in each row
+            keep = [i for i, name in enumerate(header) if columns is None or name in columns]
+            names = [header[i] for i in keep]
+            batch = []
+            for row in rows:
+                # Skip fully empty rows, same as pd.read_excel
+                if all(value is None for value in row):
+                    continue
+                batch.append(tuple(row[i] if i < len(row) else None for i in keep))
+                if len(batch) >= batch_size:
+                    yield ExcelFormat._parse_batch(names, batch)
+                    batch = []
+
+            if batch:
+                yield ExcelFormat._parse_batch(names, batch)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def inspect(file_path: Path) -> Tuple[List, Optional[int]]:
+        """Header names and row count from the sheet's stored dimensions."""
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            header = next(ws.iter_rows(max_row=1, values_only=True), ())
+            rows = ws.max_row - 1 if ws.max_row else None
+            return [name for name in header if name is not None], rows
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _parse_batch(names: List, rows: List[tuple]) -> pd.DataFrame:
+        """
+        Build a DataFrame from raw row values.
+
+        TextParser is the parser pd.read_excel uses internally, so numbers
+        stored as text and blank cells get the same types as a full load.
+        """
+        return TextParser([names] + rows, header=0).read()
+
+
+class CsvFormat:
+    """Reads .csv files with the pyarrow engine, or pandas' C engine without pyarrow."""
+
+    @staticmethod
+    def _usecols(file_path: Path, columns: Optional[frozenset]) -> Optional[List[str]]:
+        # The pyarrow engine only accepts a list of names, not a callable
+        if columns is None:
+            return None
+        header = pd.read_csv(file_path, nrows=0).columns
+        return [name for name in header if name in columns]
+
+    @staticmethod
+    def read(file_path: Path, columns: Optional[frozenset]) -> pd.DataFrame:
+        engine = 'pyarrow' if pyarrow is not None else 'c'
+        return pd.read_csv(file_path, usecols=CsvFormat._usecols(file_path, columns), engine=engine)
+
+    @staticmethod
+    def iter_batches(file_path: Path, columns: Optional[frozenset], batch_size: int) -> Iterator[pd.DataFrame]:
+        # Only the C engine supports chunked reading
+        usecols = CsvFormat._usecols(file_path, columns)
+        with pd.read_csv(file_path, usecols=usecols, chunksize=batch_size, engine='c') as reader:
+            yield from reader
+
+    @staticmethod
+    def inspect(file_path: Path) -> Tuple[List, Optional[int]]:
+        """Header names and line count (an estimate with quoted newlines)."""
+        header = list(pd.read_csv(file_path, nrows=0).columns)
+        with open(file_path, 'rb') as f:
+            lines = sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+        return header, max(lines - 1, 0)
+
+
+class ParquetFormat:
+    """Reads .parquet files through pyarrow."""
+
+    @staticmethod
+    def read(file_path: Path, columns: Optional[frozenset]) -> pd.DataFrame:
+        require_pyarrow(file_path)
+        names = parquet.read_schema(file_path).names
+        return parquet.read_table(file_path, columns=projected(names, columns)).to_pandas()
+
+    @staticmethod
+    def iter_batches(file_path: Path, columns: Optional[frozenset], batch_size: int) -> Iterator[pd.DataFrame]:
+        require_pyarrow(file_path)
+        parquet_file = parquet.ParquetFile(file_path)
+        names = projected(parquet_file.schema_arrow.names, columns)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=names):
+            yield batch.to_pandas()
+
+    @staticmethod
+    def inspect(file_path: Path) -> Tuple[List, Optional[int]]:
+        """Header names and row count from the file metadata."""
+        require_pyarrow(file_path)
+        metadata = parquet.read_metadata(file_path)
+        return metadata.schema.to_arrow_schema().names, metadata.num_rows
+
+
+class ArrowFormat:
+    """
+    Reads Arrow IPC / Feather files through pyarrow.
+
+    Files are memory-mapped rather than read into private memory, and the
+    DataFrame is built with split_blocks so columns Arrow can hand over
+    without conversion (numbers without nulls, and strings on pyarrow-backed
+    pandas) stay views of the mapped pages. Processes reading the same file
+    share those pages through the OS page cache. Compressed files (the
+    Feather default) are decompressed into private memory, so inputs meant
+    for mapping should be written with compression='uncompressed'.
+    """
+
+    @staticmethod
+    def read(file_path: Path, columns: Optional[frozenset]) -> pd.DataFrame:
+        require_pyarrow(file_path)
+        reader = ipc.open_file(pyarrow.memory_map(str(file_path), 'r'))
+        table = reader.read_all().select(projected(reader.schema.names, columns))
+        return table.to_pandas(split_blocks=True)
+
+    @staticmethod
+    def iter_batches(file_path: Path, columns: Optional[frozenset], batch_size: int) -> Iterator[pd.DataFrame]:
+        require_pyarrow(file_path)
+        with ipc.open_file(pyarrow.memory_map(str(file_path), 'r')) as reader:
+            names = projected(reader.schema.names, columns)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i).select(names)
+                for offset in range(0, batch.num_rows, batch_size):
+                    yield batch.slice(offset, batch_size).to_pandas(split_blocks=True)
+
+    @staticmethod
+    def inspect(file_path: Path) -> Tuple[List, Optional[int]]:
+        """Header names and row count from the mapped record batches."""
+        require_pyarrow(file_path)
+        with ipc.open_file(pyarrow.memory_map(str(file_path), 'r')) as reader:
+            rows = sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+            return reader.schema.names, rows
+
+
+# Readers by file extension; Config.INPUT_FILES picks the format per table
+INPUT_FORMATS = {
+    '.xlsx': ExcelFormat,
+    '.csv': CsvFormat,
+    '.parquet': ParquetFormat,
+    '.arrow': ArrowFormat,
+    '.feather': ArrowFormat
+}
+
+
+def input_format(file_path: Path):
+    """Return the reader registered for the file's extension."""
+    reader = INPUT_FORMATS.get(file_path.suffix.lower())
+    if reader is None:
+        raise ValueError(f"Unsupported input format '{file_path.suffix}' for {file_path.name}")
+    return reader
+
+
+def require_pyarrow(file_path: Path) -> None:
+    if pyarrow is None:
+        raise ImportError(f"pyarrow is required to read {file_path.name}")
+
+
+def projected(names: List[str], columns: Optional[frozenset]) -> List[str]:
+    """Names of `names` kept by the column projection, in file order."""
+    return [name for name in names if columns is None or name in columns]
+
+# ============================================================================
+# Parsed Input Cache
+# ============================================================================
+
+class ParsedFileCache:
+    """
+    Columnar (Feather) cache of parsed and normalized input files.
+
+    Entries are keyed by the source file's content hash and a loader variant
+    (normalization version and column projection), so a changed file or
+    changed cleaning rules never hit a stale entry. The cache folder is capped at `max_bytes`; the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, cache_folder: str, max_bytes: int):
+        self.cache_folder = Path(cache_folder)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def available() -> bool:
+        """Feather files need the optional pyarrow package."""
+        return feather is not None
+
+    @staticmethod
+    def file_hash(file_path: Path) -> str:
+        """SHA-256 of the file content, read in blocks."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _entry_path(self, file_path: Path, variant: str) -> Path:
+        key = f"{self.file_hash(file_path)}-{variant}"
+        return self.cache_folder / f"{file_path.stem}-{key}.feather"
+
+    def get(self, file_path: Path, variant: str) -> Optional[pd.DataFrame]:
+        """Return the cached DataFrame for `file_path`, or None on a miss."""
+        entry = self._entry_path(file_path, variant)
+        if not entry.exists():
+            return None
+
+        try:
+            table = feather.read_table(entry, memory_map=True)
+            df = table.to_pandas(split_blocks=True)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry {entry.name}: {str(e)}")
+            return None
+
+        # Bump mtime so the entry counts as recently used
+        entry.touch()
+        return df
+
+    def put(self, file_path: Path, variant: str, df: pd.DataFrame) -> None:
+        """Store `df` for `file_path` and evict old entries beyond the cap."""
+        try:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            entry = self._entry_path(file_path, variant)
+            tmp = entry.with_suffix('.tmp')
+            # Uncompressed, so hits can be memory-mapped without decoding
+            feather.write_feather(df.reset_index(drop=True), tmp, compression='uncompressed')
+            tmp.replace(entry)
+            self.evict()
+        except Exception as e:
+            logger.warning(f"Could not cache {file_path.name}: {str(e)}")
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the folder fits the cap."""
+        entries = sorted(self.cache_folder.glob('*.feather'), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in entries)
+
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            entry.unlink()
+            logger.info(f"Evicted cache entry {entry.name}")
+
+# ============================================================================
+# Data Loader
+# ============================================================================
+
+class DataLoader:
+    """Handles loading input files (see INPUT_FORMATS) from the input folder."""
+    
+    # Bump whenever normalize() changes its output, invalidates cached files
+    NORMALIZATION_VERSION = 2
+    
+    def __init__(self, input_folder: str, max_workers: int = 1,
+                 cache: Optional[ParsedFileCache] = None,
+                 columns: Optional[Iterable[str]] = None,
+                 schemas: Optional[Dict[str, Dict]] = None):
+        self.input_folder = Path(input_folder)
+        # max_workers > 1 parses the input files in a process pool
+        self.max_workers = max_workers
+        self.cache = cache
+        # Only these columns are read from each file (None = all columns)
+        self.columns = frozenset(columns) if columns is not None else None
+        # Column schemas per table name, see Config.INPUT_SCHEMAS
+        self.schemas = schemas or {}
+
+    # Key columns that are cleaned regardless of their parsed dtype
+    KEY_COLUMNS = ['Plant', 'SupplierID', 'ManufacturerID']
+
+    @staticmethod
+    def _clean_values(col: str, values: pd.Series) -> pd.Series:
+        """Trim text and repair key formatting for the values of one column."""
+
+        # Trim whitespace
+        if values.dtype == 'object':
+            values = values.astype(str).str.strip()
+            values = values.replace('nan', pd.NA)
+
+        # Preserve leading zeros for Plant
+        if col == 'Plant':
+            values = (
+                values
+                .where(values.notna(), pd.NA)
+                .astype(str)
+                .str.replace(r'\.0$', '', regex=True)
+                .str.zfill(4)
+                .replace('000nan', pd.NA)
+            )
+
+        if col in ['SupplierID', 'ManufacturerID']:
+            values = (
+                values
+                .where(values.notna(), pd.NA)
+                .astype(str)
+                .str.replace(r'\.0$', '', regex=True)
+                .str.strip()
+            )
+
+        return values
+
+    @staticmethod
+    def _clean_distinct(col: str, series: pd.Series) -> pd.Series:
+        """
+        Apply _clean_values to each distinct value once.
+
+        Key and text columns repeat a small set of values across many rows,
+        so the column is factorized, only the uniques go through the string
+        operations and the cleaned uniques are mapped back via the codes.
+        """
+        # factorize treats 20 and 20.0 (or 1 and True) as equal, but their
+        # string forms differ; mixed-type object columns are cleaned row-wise
+        if series.dtype == 'object' and pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'empty'):
+            return DataLoader._clean_values(col, series)
+
+        codes, uniques = series.factorize()
+        values = pd.Series(uniques)
+
+        # factorize drops NA; clean the first NA value like any other value
+        na_mask = codes == -1
+        if na_mask.any():
+            values = pd.concat([values, series[na_mask].iloc[:1]], ignore_index=True)
+            codes = codes.copy()
+            codes[na_mask] = len(uniques)
+
+        cleaned = DataLoader._clean_values(col, values)
+        return cleaned.take(codes).set_axis(series.index)
+
+    @staticmethod
+    def normalize(df: pd.DataFrame, schema: Optional[Dict[str, Dict]] = None) -> pd.DataFrame:
+        """
+        Clean key columns and trim whitespace in text columns.
+
+        Columns listed in `schema` are cast to their declared dtype instead
+        of going through the string repairs; 'str' columns are first turned
+        into text (see _as_text) and then repaired like any text column.
+        """
+        schema = schema or {}
+        for col in df.columns:
+            dtype = schema[col]['dtype'] if col in schema else None
+            if dtype is not None and dtype != 'str':
+                df[col] = DataLoader._cast(df[col], dtype)
+                continue
+            if dtype == 'str':
+                df[col] = DataLoader._as_text(df[col])
+            if df[col].dtype == 'object' or col in DataLoader.KEY_COLUMNS:
+                df[col] = DataLoader._clean_distinct(col, df[col])
+
+        return df
+
+    @staticmethod
+    def _as_text(series: pd.Series) -> pd.Series:
+        """
+        Numbers in a parsed column as the text a full sheet load gives them.
+
+        The parser infers each column's type from the rows it sees, so a
+        batch of a mixed column may come out numeric while the whole sheet
+        parses as text. Integral floats (integers with blanks) lose '.0'.
+        """
+        if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+            return series
+
+        def text(value) -> str:
+            if isinstance(value, float) and value.is_integer():
+                return str(int(value))
+            return str(value)
+
+        return series.astype(object).map(text, na_action='ignore').infer_objects()
+
+    @staticmethod
+    def _cast(series: pd.Series, dtype: str) -> pd.Series:
+        """Cast a parsed column to a declared numeric dtype."""
+        if series.dtype == dtype:
+            return series
+
+        # Numbers stored as text, possibly padded with spaces
+        if not pd.api.types.is_numeric_dtype(series):
+            series = series.astype('string').str.strip().replace('', pd.NA)
+
+        return pd.to_numeric(series).astype(dtype)
+
+    @staticmethod
+    def read_file(file_path: Path, columns: Optional[frozenset] = None,
+                  schema: Optional[Dict[str, Dict]] = None) -> pd.DataFrame:
+        """
+        Parse and normalize a single input file in any registered format.
+
+        Only `columns` are converted and normalized when given, and columns
+        in `schema` are cast to their declared dtype. Kept free of instance
+        state so it can run inside a worker process.
+        """
+        df = input_format(file_path).read(file_path, columns)
+        return DataLoader.normalize(df, schema)
+        
+    def load_file(self, filename: str, schema: Optional[Dict[str, Dict]] = None) -> Optional[pd.DataFrame]:
+        """Load a single input file, casting columns declared in `schema`."""
+        file_path = self.input_folder / filename
+        
+        try:
+            if not file_path.exists():
+                logger.error(f"File not found: {file_path}")
+                return None
+            
+            df = self._from_cache(file_path, schema)
+            if df is None:
+                df = self.read_file(file_path, self.columns, schema)
+                self._to_cache(file_path, schema, df)
+            
+            logger.info(f"Loaded {filename}: {len(df)} rows, {len(df.columns)} columns")
+            return df
+            
+        except Exception as e:
+            logger.error(f"[ERROR] Error loading {filename}: {str(e)}")
+            return None
+
+    def _from_cache(self, file_path: Path, schema: Optional[Dict[str, Dict]]) -> Optional[pd.DataFrame]:
+        if self.cache is None:
+            return None
+        df = self.cache.get(file_path, self._cache_variant(schema))
+        if df is not None:
+            logger.info(f"Cache hit for {file_path.name}")
+        return df
+
+    def _to_cache(self, file_path: Path, schema: Optional[Dict[str, Dict]], df: pd.DataFrame) -> None:
+        if self.cache is not None:
+            self.cache.put(file_path, self._cache_variant(schema), df)
+
+    def _cache_variant(self, schema: Optional[Dict[str, Dict]]) -> str:
+        """Cache key part for the normalization version, projection and schema."""
+        columns = sorted(self.columns) if self.columns is not None else None
+        options = repr((columns, sorted((schema or {}).items())))
+        return f"v{self.NORMALIZATION_VERSION}-{hashlib.sha256(options.encode()).hexdigest()[:12]}"
+
+    def iter_batches(self, filename: str, batch_size: Optional[int] = None,
+                     schema: Optional[Dict[str, Dict]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Stream an input file as normalized DataFrame batches.
+
+        Each format reads incrementally, so only one batch is held in memory
+        at a time. Errors are raised to the caller.
+        """
+        batch_size = batch_size or Config.STREAM_BATCH_SIZE
+        file_path = self.input_folder / filename
+
+        if not file_path.exists():
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        total = 0
+        for batch in input_format(file_path).iter_batches(file_path, self.columns, batch_size):
+            total += len(batch)
+            yield self.normalize(batch, schema)
+
+        logger.info(f"Streamed {filename}: {total} rows in batches of {batch_size}")
+
+    def load_files_parallel(self, file_mapping: Dict[str, str]) -> Dict[str, Optional[pd.DataFrame]]:
+        """
+        Load several input files concurrently in a process pool.
+
+        Parsing is CPU bound, so each file gets its own process. Results are
+        keyed by filename; they and the log messages are reported in mapping
+        order, with the same messages as load_file.
+        """
+        results: Dict[str, Optional[pd.DataFrame]] = {}
+        cached = {}
+        futures = {}
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            for data_type, filename in file_mapping.items():
+                file_path = self.input_folder / filename
+                schema = self.schemas.get(data_type)
+                if not file_path.exists():
+                    continue
+                df = self._from_cache(file_path, schema)
+                if df is not None:
+                    cached[filename] = df
+                else:
+                    futures[filename] = executor.submit(self.read_file, file_path, self.columns, schema)
+
+            for data_type, filename in file_mapping.items():
+                if filename in cached:
+                    df = cached[filename]
+                    logger.info(f"Loaded {filename}: {len(df)} rows, {len(df.columns)} columns")
+                    results[filename] = df
+                    continue
+
+                if filename not in futures:
+                    logger.error(f"File not found: {self.input_folder / filename}")
+                    results[filename] = None
+                    continue
+
+                try:
+                    df = futures[filename].result()
+                    self._to_cache(self.input_folder / filename, self.schemas.get(data_type), df)
+                    logger.info(f"Loaded {filename}: {len(df)} rows, {len(df.columns)} columns")
+                    results[filename] = df
+                except Exception as e:
+                    logger.error(f"[ERROR] Error loading {filename}: {str(e)}")
+                    results[filename] = None
+
+        return results
+    
+    def load_all(self, file_mapping: Dict[str, str]) -> Tuple[Dict[str, pd.DataFrame], bool]:
+        """Load all required files."""
+        logger.info("=" * 70)
+        logger.info("LOADING INPUT FILES")
+        logger.info("=" * 70)
+        
+        dataframes = {}
+        all_loaded = True
+
+        if self.max_workers > 1:
+            loaded = self.load_files_parallel(file_mapping)
+        else:
+            loaded = {}
+
+        # File Error handling
+        for data_type, filename in file_mapping.items():
+            if filename in loaded:
+                df = loaded[filename]
+            else:
+                df = self.load_file(filename, self.schemas.get(data_type))
+            if df is None:
+                all_loaded = False
+                logger.error(f"Failed to load required file: {filename}")
+            else:
+                dataframes[data_type] = df
+        
+        if all_loaded:
+            logger.info("All files loaded successfully\n")
+        else:
+            logger.error("[ERROR] Some files failed to load\n")
+        
+        return dataframes, all_loaded
+
+# ============================================================================
+# Key Encoding
+# ============================================================================
+
+class KeyEncoder:
+    """
+    Dictionary-encodes join keys with one shared dictionary per key domain.
+
+    Every table holding a key column gets the same Categorical dtype for it,
+    so merges, duplicate checks and groupbys compare integer codes instead of
+    hashing the original values. Categories are sorted, so code order equals
+    value order. decode() turns the keys back into their original values.
+    """
+
+    KEY_DOMAINS = ['MaterialReference', 'Plant', 'SupplierID', 'ManufacturerID']
+
+    def __init__(self):
+        self.dtypes: Dict[str, pd.CategoricalDtype] = {}
+
+    def fit(self, dataframes: Dict[str, pd.DataFrame]) -> 'KeyEncoder':
+        """Build the dictionary of each key domain from all tables."""
+        for col in self.KEY_DOMAINS:
+            values = [df[col].dropna().unique() for df in dataframes.values() if col in df.columns]
+            if not values:
+                continue
+            categories = pd.Index(pd.concat([pd.Series(v) for v in values], ignore_index=True).unique())
+            self.dtypes[col] = pd.CategoricalDtype(categories.sort_values())
+        return self
+
+    def encode(self, dataframes: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        """Return shallow copies of the tables with encoded key columns."""
+        encoded = {}
+        for name, df in dataframes.items():
+            keys = {col: df[col].astype(dtype) for col, dtype in self.dtypes.items() if col in df.columns}
+            encoded[name] = df.assign(**keys) if keys else df
+        return encoded
+
+    def extend(self, df: pd.DataFrame) -> bool:
+        """
+        Add key values of `df` missing from the dictionaries.
+
+        New values are appended after the sorted categories, so existing
+        codes stay valid. Returns True if any dictionary grew.
+        """
+        grown = False
+        for col, dtype in self.dtypes.items():
+            if col not in df.columns:
+                continue
+            new = pd.Index(df[col].dropna().unique()).difference(dtype.categories)
+            if len(new):
+                self.dtypes[col] = pd.CategoricalDtype(dtype.categories.append(new))
+                grown = True
+        return grown
+
+    def decode(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Turn encoded key columns back into their original values."""
+        for col, dtype in self.dtypes.items():
+            if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype):
+                categories = df[col].cat.categories
+                if isinstance(categories.dtype, pd.api.extensions.ExtensionDtype):
+                    # Gather the values by code, without per-row objects
+                    df[col] = pd.api.extensions.take(
+                        categories.array, df[col].cat.codes.to_numpy(), allow_fill=True
+                    )
+                else:
+                    df[col] = df[col].astype(dtype.categories.dtype)
+        return df
+
+# ============================================================================
+# Join Engine
+# ============================================================================
+
+class JoinEngine:
+    """
+    Resolves the aggregation's left joins as row positions on encoded keys.
+
+    One hash index is built per dimension table on its key codes (combined
+    into one int64 for multi-column keys). Storage rows are resolved to a
+    row position in every dimension (-1 for no match), chaining through a
+    dimension where the key comes from one (ManufacturerID from materials,
+    SupplierID from the primary supplier). Output columns are gathered with
+    one take each, instead of copying the growing frame at every merge.
+
+    Only applies when all keys are dictionary-encoded (KeyEncoder) and unique
+    in their dimension; otherwise build() returns None and callers merge.
+    """
+
+    def __init__(self, dimensions: Dict[str, pd.DataFrame], steps: List[Tuple[str, List[str], str]]):
+        self.dimensions = dimensions
+        self.steps = steps
+        self.indexes: Dict[str, pd.Index] = {}
+        # Bitmaps of the last resolve() per looked-up table: rows with a
+        # complete key, and rows that found a match
+        self.lookups: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.positions: Dict[str, Optional[np.ndarray]] = {}
+
+    @classmethod
+    def build(cls, dimensions: Dict[str, pd.DataFrame],
+              steps: List[Tuple[str, List[str], str]]) -> Optional['JoinEngine']:
+        """Index every dimension of `steps`; None if one cannot be indexed."""
+        engine = cls(dimensions, steps)
+        for name, keys, _ in steps:
+            df = dimensions.get(name)
+            if df is None:
+                continue
+            if not cls.encoded(df, keys):
+                logger.info(f"  {name}: keys {keys} not encoded, using merge joins")
+                return None
+            index = pd.Index(cls.key_codes(df, keys))
+            if not index.is_unique:
+                logger.info(f"  {name}: duplicate keys {keys}, using merge joins")
+                return None
+            engine.indexes[name] = index
+        return engine
+
+    @staticmethod
+    def encoded(df: pd.DataFrame, keys: List[str]) -> bool:
+        return all(k in df.columns and isinstance(df[k].dtype, pd.CategoricalDtype) for k in keys)
+
+    @staticmethod
+    def key_codes(df: pd.DataFrame, keys: List[str], positions: Optional[np.ndarray] = None,
+                  present: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Combine the category codes of `keys` into one int64 per row.
+
+        Codes are shifted by one so NA (code -1) becomes 0 and matches NA,
+        like merge does. With `positions`, codes are gathered at those rows
+        and missing rows (-1) get the NA code. Rows with an NA key part are
+        cleared in `present` when it is given.
+        """
+        n = len(df) if positions is None else len(positions)
+        combined = np.zeros(n, dtype=np.int64)
+        for key in keys:
+            codes = df[key].cat.codes.to_numpy().astype(np.int64) + 1
+            if positions is not None:
+                codes = codes[positions] if len(codes) else np.zeros(n, dtype=np.int64)
+                codes[positions < 0] = 0
+            if present is not None:
+                present &= codes != 0
+            combined = combined * (len(df[key].cat.categories) + 1) + codes
+        return combined
+
+    def resolve(self, storage: pd.DataFrame) -> Dict[str, Optional[np.ndarray]]:
+        """Row position of each storage row in every joined table."""
+        positions: Dict[str, Optional[np.ndarray]] = {'storage': None}
+        for name, keys, source in self.steps:
+            if name not in self.indexes or source not in positions:
+                continue
+            source_df = storage if source == 'storage' else self.dimensions[source]
+            if not all(k in source_df.columns for k in keys):
+                continue
+            present = np.ones(len(storage), dtype=bool)
+            left = self.key_codes(source_df, keys, positions[source], present)
+            positions[name] = self.indexes[name].get_indexer(left)
+            self.lookups[name] = (present, positions[name] >= 0)
+        self.positions = positions
+        return positions
+
+    def join(self, storage: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+        """Left-join storage with all dimensions and project `columns`."""
+        positions = self.resolve(storage)
+        tables = {'storage': storage, **self.dimensions}
+
+        data = {}
+        for col in columns:
+            # Storage first, then dimensions in join order, as with merges
+            source = next((name for name in positions if col in tables[name].columns), None)
+            if source is None:
+                data[col] = pd.Series(pd.NA, index=range(len(storage)), dtype=object)
+                continue
+            values = tables[source][col]
+            values = values.array if pd.api.types.is_extension_array_dtype(values) else values.to_numpy()
+            if positions[source] is not None:
+                values = pd.api.extensions.take(values, positions[source], allow_fill=True)
+            data[col] = values
+
+        # Gathered arrays are new; wrap them without another copy
+        return pd.DataFrame(data, columns=columns, copy=False)
+
+# ============================================================================
+# Join Planner
+# ============================================================================
+
+class JoinPlanner:
+    """
+    Chooses the order of the merge-based joins from table statistics.
+
+    A lookup whose key comes from a dimension (manufacturer names via
+    materials, supplier names via the primary supplier) is pre-joined into
+    that dimension when the dimension has fewer rows than storage, so the
+    storage-grain frame is touched once per storage-keyed table only.
+    Storage-grain joins run in order of increasing fanout (rows per key), so
+    joins that can multiply rows come last and earlier joins see fewer rows.
+    """
+
+    @staticmethod
+    def statistics(tables: Dict[str, pd.DataFrame],
+                   steps: List[Tuple[str, List[str], str]]) -> Dict[str, Dict]:
+        """Row count and key cardinality of each dimension in `steps`."""
+        stats = {}
+        for name, keys, _ in steps:
+            df = tables.get(name)
+            if df is None or not all(k in df.columns for k in keys):
+                continue
+            cardinality = df[keys[0]].nunique() if len(keys) == 1 else len(df[keys].drop_duplicates())
+            stats[name] = {'rows': len(df), 'cardinality': cardinality}
+        return stats
+
+    @staticmethod
+    def plan(tables: Dict[str, pd.DataFrame], storage_rows: int,
+             steps: List[Tuple[str, List[str], str]]) -> Tuple[List, List]:
+        """
+        Split `steps` into pre-joins and storage-grain joins.
+
+        Returns (prejoins, storage_joins): prejoins are (into, table, keys)
+        and run first among dimensions, storage_joins are (table, keys) and
+        run against the storage frame.
+        """
+        stats = JoinPlanner.statistics(tables, steps)
+        prejoins = []
+        storage_joins = []
+        dependent = []
+        for name, keys, source in steps:
+            if name not in stats:
+                continue
+            if source == 'storage':
+                storage_joins.append((name, keys))
+                continue
+            source_df = tables.get(source)
+            if source not in stats or not all(k in source_df.columns for k in keys):
+                continue
+            if stats[source]['rows'] < storage_rows:
+                prejoins.append((source, name, keys))
+            else:
+                dependent.append((name, keys))
+
+        def fanout(join):
+            table = stats[join[0]]
+            return (table['rows'] / max(table['cardinality'], 1), table['rows'])
+
+        storage_joins.sort(key=fanout)
+        storage_joins.extend(dependent)
+
+        logger.info("  Join plan:")
+        for into, name, keys in prejoins:
+            logger.info(
+                f"    pre-join {into} ({stats[into]['rows']} rows) ⋈ {name} "
+                f"({stats[name]['rows']} rows) on {keys}"
+            )
+        for name, keys in storage_joins:
+            logger.info(
+                f"    storage ({storage_rows} rows) ⋈ {name} ({stats[name]['rows']} rows, "
+                f"{stats[name]['cardinality']} keys) on {keys}"
+            )
+
+        return prejoins, storage_joins
+
+# ============================================================================
+# Material Dimension Cache
+# ============================================================================
+
+class MaterialDimensionCache:
+    """
+    Persistent copy of the material dimension (requires pyarrow).
+
+    The dimension depends only on the materials, manufacturer_names,
+    suppliers and supplier_names tables. It is stored as one Feather file
+    named after a hash of those tables' normalized content, its columns and
+    DIMENSION_VERSION, so it is rebuilt exactly when one of them changes.
+    Older versions are deleted when a new one is stored.
+    """
+
+    DIMENSION_VERSION = 2
+    PREFIX = "material_dimension"
+
+    def __init__(self, cache_folder: str):
+        self.cache_folder = Path(cache_folder)
+
+    @staticmethod
+    def available() -> bool:
+        return feather is not None
+
+    def key(self, tables: Dict[str, pd.DataFrame], columns: List[str]) -> str:
+        """Version of the dimension built from `tables` with `columns`."""
+        digest = hashlib.sha256()
+        digest.update(repr((self.DIMENSION_VERSION, DataLoader.NORMALIZATION_VERSION, columns)).encode())
+        for name in sorted(tables):
+            df = tables[name]
+            digest.update(repr((name, list(df.columns), [str(t) for t in df.dtypes])).encode())
+            digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        return digest.hexdigest()[:32]
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_folder / f"{self.PREFIX}-{key}.feather"
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Stored dimension for `key`, or None."""
+        entry = self._entry_path(key)
+        if not entry.exists():
+            return None
+        try:
+            return feather.read_table(entry, memory_map=True).to_pandas(split_blocks=True)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable material dimension {entry.name}: {str(e)}")
+            return None
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """Store the dimension for `key`, replacing older versions."""
+        try:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            entry = self._entry_path(key)
+            tmp = entry.with_suffix('.tmp')
+            feather.write_feather(df.reset_index(drop=True), tmp, compression='uncompressed')
+            tmp.replace(entry)
+            for old in self.cache_folder.glob(f"{self.PREFIX}-*.feather"):
+                if old != entry:
+                    old.unlink()
+        except Exception as e:
+            logger.warning(f"Could not store material dimension: {str(e)}")
+
+# ============================================================================
+# Data Aggregator
+# ============================================================================
+
+class MaterialDataAggregator:
+    """Aggregates material data from multiple sources."""
+    
+    # Join graph of aggregate(): table -> keys it is joined on
+    JOIN_KEYS = {
+        'materials': ['MaterialReference'],
+        'manufacturer_names': ['ManufacturerID'],
+        'plants': ['MaterialReference', 'Plant'],
+        'suppliers': ['MaterialReference', 'SupplierID'],
+        'supplier_names': ['SupplierID']
+    }
+
+    # Lookups of join_storage in order: (table, keys, table the keys come
+    # from). 'suppliers' is the primary supplier per material.
+    JOIN_STEPS = [
+        ('materials', ['MaterialReference'], 'storage'),
+        ('manufacturer_names', ['ManufacturerID'], 'materials'),
+        ('plants', ['MaterialReference', 'Plant'], 'storage'),
+        ('suppliers', ['MaterialReference'], 'storage'),
+        ('supplier_names', ['SupplierID'], 'suppliers')
+    ]
+
+    # Tables the material dimension is built from: everything joined on
+    # MaterialReference alone, directly or through another of them
+    MATERIAL_TABLES = ['materials', 'manufacturer_names', 'suppliers', 'supplier_names']
+
+    # Lookups of join_storage when the material dimension is available
+    MATERIAL_DIMENSION_STEPS = [
+        ('material_dimension', ['MaterialReference'], 'storage'),
+        ('plants', ['MaterialReference', 'Plant'], 'storage')
+    ]
+
+    # Lookup state of each material table kept in the material dimension:
+    # 1 matched, -1 key without a match, 0 no key to look up
+    LOOKUP_PREFIX = '_lookup_'
+
+    # Orphan keys kept per relationship for the validation report
+    SAMPLE_SIZE = 5
+
+    def __init__(self, dataframes: Dict[str, pd.DataFrame], encode_keys: bool = True,
+                 primary_suppliers: Optional[pd.DataFrame] = None,
+                 dimension_cache: Optional[MaterialDimensionCache] = None):
+        # Inputs as loaded, handed to worker processes when partitioning
+        self.sources = dataframes
+        # Join keys are dictionary-encoded once so every step below works on
+        # integer codes; aggregate() decodes them for the output
+        self.encoder = KeyEncoder().fit(dataframes) if encode_keys else None
+        self.data = self.encoder.encode(dataframes) if encode_keys else dataframes
+        # Precomputed primary suppliers may be passed in (partition workers)
+        if primary_suppliers is not None and self.encoder is not None:
+            primary_suppliers = self.encoder.encode({'p': primary_suppliers})['p']
+        self._primary_suppliers: Optional[pd.DataFrame] = primary_suppliers
+        # None until built, False if the dimensions cannot be indexed
+        self._engine = None
+        # Pre-joined dimensions and storage joins of the merge path
+        self._merge_plan = None
+        # Material dimension (decoded); None until built, False if unavailable
+        self._material_dimension = None
+        self.dimension_cache = dimension_cache
+        # Per joined table: looked-up rows, orphans and sample orphan keys
+        # of all storage rows joined so far, see record_lookups()
+        self.references: Dict[str, Dict] = {}
+
+    @staticmethod
+    def required_columns() -> List[str]:
+        """
+        Columns the aggregation reads from any input table.
+
+        The output columns plus every join key; everything else in the
+        inputs can be skipped at load time.
+        """
+        columns = list(Config.OUTPUT_COLUMNS)
+        for keys in MaterialDataAggregator.JOIN_KEYS.values():
+            columns.extend(k for k in keys if k not in columns)
+        return columns
+        
+    def get_primary_suppliers(self) -> pd.DataFrame:
+
+        if 'suppliers' not in self.data:
+            logger.warning("Suppliers data not available")
+            return pd.DataFrame()
+        
+        suppliers = self.data['suppliers']
+        
+        # Pick the row with the lowest SupplierID per material in one pass
+        # (no global sort) and keep it whole. Typed inputs already hold
+        # integer IDs; text IDs are compared numerically. Missing IDs rank
+        # last, so a material with only missing IDs keeps its first row.
+        order = self._numeric_order(suppliers['SupplierID']).astype('float64')
+        order = order.where(suppliers['SupplierID'].notna()).fillna(np.inf)
+        lowest = order.groupby(suppliers['MaterialReference'], observed=True).idxmin()
+        primary_suppliers = suppliers.loc[lowest.to_numpy()].reset_index(drop=True)
+        
+        logger.info(f"  Selected primary supplier (lowest ID) from {len(suppliers)} records → {len(primary_suppliers)} materials")
+        return primary_suppliers
+    
+    def primary_suppliers(self) -> pd.DataFrame:
+        """Primary suppliers, selected once and reused for every chunk."""
+        if self._primary_suppliers is None:
+            self._primary_suppliers = self.get_primary_suppliers()
+        return self._primary_suppliers
+
+    def join_engine(self) -> Optional[JoinEngine]:
+        """Join engine over the dimension tables, built once per key encoding."""
+        if self.encoder is None:
+            return None
+        if self._engine is None:
+            material_dimension = self.material_dimension()
+            if material_dimension is not None:
+                dimensions = self.encoder.encode({'material_dimension': material_dimension})
+                if 'plants' in self.data:
+                    dimensions['plants'] = self.data['plants']
+                self._engine = JoinEngine.build(dimensions, self.MATERIAL_DIMENSION_STEPS) or False
+            else:
+                self._engine = JoinEngine.build(self._dimension_tables(), self.JOIN_STEPS) or False
+            if self._engine:
+                logger.info(f"  Join plan: one position lookup per table in {list(self._engine.indexes)}")
+        return self._engine or None
+
+    def _dimension_tables(self) -> Dict[str, pd.DataFrame]:
+        """Encoded dimension tables, with suppliers reduced to the primary ones."""
+        dimensions = {name: df for name, df in self.data.items() if name != 'storage'}
+        if dimensions.pop('suppliers', None) is not None:
+            primary_suppliers = self.primary_suppliers()
+            if not primary_suppliers.empty:
+                dimensions['suppliers'] = primary_suppliers
+        return dimensions
+
+    def material_dimension_columns(self) -> List[str]:
+        """
+        Output columns the material dimension provides.
+
+        A column belongs to the dimension if, in join order, it is first
+        found in one of MATERIAL_TABLES, so columns taken from storage or
+        plants keep their source. Keys of the chained lookups are kept for
+        the orphan samples of record_lookups().
+        """
+        columns = ['MaterialReference']
+        for name, keys, source in self.JOIN_STEPS:
+            if name in self.MATERIAL_TABLES and source != 'storage':
+                columns.extend(k for k in keys if k not in columns and k in self.data[source].columns)
+        order = ['storage'] + [name for name, _, _ in self.JOIN_STEPS]
+        for col in Config.OUTPUT_COLUMNS:
+            source = next((name for name in order if name in self.data and col in self.data[name].columns), None)
+            if source in self.MATERIAL_TABLES and col not in columns:
+                columns.append(col)
+        return columns
+
+    def material_dimension(self) -> Optional[pd.DataFrame]:
+        """
+        One row per material with its manufacturer, primary supplier and
+        supplier name columns, or None if it cannot be built.
+
+        Read from dimension_cache when the four source tables are unchanged,
+        built and stored otherwise.
+        """
+        if self._material_dimension is None:
+            self._material_dimension = False
+            if self.encoder is not None and all(name in self.data for name in self.MATERIAL_TABLES):
+                columns = self.material_dimension_columns()
+                key = None
+                dimension = None
+                if self.dimension_cache is not None:
+                    tables = {name: self.sources[name] for name in self.MATERIAL_TABLES}
+                    key = self.dimension_cache.key(tables, columns)
+                    dimension = self.dimension_cache.get(key)
+                if dimension is not None:
+                    logger.info(f"  Material dimension: {len(dimension)} materials (cached)")
+                else:
+                    dimension = self.build_material_dimension(columns)
+                    if dimension is not None:
+                        logger.info(f"  Material dimension: {len(dimension)} materials (built)")
+                        if key is not None:
+                            self.dimension_cache.put(key, dimension)
+                if dimension is not None:
+                    self._material_dimension = dimension
+        return self._material_dimension if self._material_dimension is not False else None
+
+    def build_material_dimension(self, columns: List[str]) -> Optional[pd.DataFrame]:
+        """
+        Join every known material with the material tables.
+
+        Runs the material steps of JOIN_STEPS through the join engine, with
+        the distinct MaterialReference values of materials and suppliers in
+        place of storage. None if the engine cannot index the tables.
+        """
+        dimensions = {name: df for name, df in self._dimension_tables().items() if name in self.MATERIAL_TABLES}
+        steps = [step for step in self.JOIN_STEPS if step[0] in self.MATERIAL_TABLES]
+        engine = JoinEngine.build(dimensions, steps)
+        if engine is None:
+            return None
+
+        references = pd.concat(
+            [self.data['materials']['MaterialReference'], self.data['suppliers']['MaterialReference']],
+            ignore_index=True
+        ).drop_duplicates()
+        materials = pd.DataFrame({'MaterialReference': references.reset_index(drop=True)})
+        dimension = engine.join(materials, columns)
+        for name, _, _ in steps:
+            if name in engine.lookups:
+                looked_up, matched = engine.lookups[name]
+                state = np.where(looked_up, np.where(matched, 1, -1), 0).astype(np.int8)
+                dimension[self.LOOKUP_PREFIX + name] = state
+        return self.encoder.decode(dimension)
+
+    @staticmethod
+    def _numeric_order(ids: pd.Series) -> pd.Series:
+        """Sort key ordering supplier IDs by numeric value."""
+        if isinstance(ids.dtype, pd.CategoricalDtype):
+            # Sorted numeric categories: code order is value order
+            if pd.api.types.is_numeric_dtype(ids.cat.categories):
+                return ids.cat.codes
+            ids = ids.astype(ids.cat.categories.dtype)
+        return pd.to_numeric(ids)
+
+    @staticmethod
+    def format_output(result: pd.DataFrame) -> pd.DataFrame:
+        """Zero-pad integer keys declared with a `pad` width in the schemas."""
+        for schema in Config.INPUT_SCHEMAS.values():
+            for col, spec in schema.items():
+                if 'pad' in spec and col in result.columns and result[col].dtype != 'object':
+                    # Pad each distinct value once; rows share the strings
+                    codes, uniques = pd.factorize(result[col])
+                    padded = pd.Series(uniques).astype('string').str.zfill(spec['pad']).astype(object)
+                    values = pd.api.extensions.take(padded.to_numpy(), codes, allow_fill=True, fill_value=pd.NA)
+                    result[col] = pd.Series(values, index=result.index, dtype=object)
+        return result
+
+    def join_storage(self, storage: pd.DataFrame) -> pd.DataFrame:
+        """
+        Join storage rows with all dimension tables and shape the output.
+
+        Used for the full storage table and for each chunk in chunked mode.
+        Uses the join engine when the keys allow it, chained merges otherwise.
+        `storage` is never modified, so callers pass their frame uncopied.
+        """
+        engine = self.join_engine()
+        with memory_step("join"):
+            if engine is not None and JoinEngine.encoded(storage, ['MaterialReference', 'Plant']):
+                result = engine.join(storage, Config.OUTPUT_COLUMNS)
+                self.record_lookups(storage, engine)
+            else:
+                result = self._merge_dimensions(storage)
+
+        with memory_step("decode and format"):
+            if self.encoder is not None:
+                result = self.encoder.decode(result)
+            return self.format_output(result)
+
+    def record_lookups(self, storage: pd.DataFrame, engine: JoinEngine) -> None:
+        """
+        Add the match bitmaps of the engine's last join to self.references.
+
+        Counts are per storage row for every step of JOIN_STEPS. With the
+        material dimension, the per-material lookup states stored in it are
+        gathered to storage rows through the dimension positions, so the
+        counts equal those of the direct lookups.
+        """
+        dimension = engine.dimensions.get('material_dimension')
+        for name, keys, source in self.JOIN_STEPS:
+            if name in engine.lookups:
+                looked_up, matched = engine.lookups[name]
+                frame = storage if source == 'storage' else engine.dimensions[source]
+                self._add_reference(name, keys, source, looked_up, matched, frame, engine.positions[source])
+                continue
+
+            column = self.LOOKUP_PREFIX + name
+            if dimension is None or column not in dimension.columns or 'material_dimension' not in engine.lookups:
+                continue
+            positions = engine.positions['material_dimension']
+            state = pd.api.extensions.take(dimension[column].to_numpy(), positions, allow_fill=True, fill_value=0)
+            if source == 'storage':
+                # A material missing from the dimension is missing from every material table
+                looked_up = engine.lookups['material_dimension'][0]
+                self._add_reference(name, keys, source, looked_up, state == 1, storage, None)
+            else:
+                self._add_reference(name, keys, source, state != 0, state == 1, dimension, positions)
+
+    def _add_reference(self, name: str, keys: List[str], source: str, looked_up: np.ndarray,
+                       matched: np.ndarray, frame: pd.DataFrame, positions: Optional[np.ndarray]) -> None:
+        """Accumulate the counts of one lookup and sample its orphan keys."""
+        orphans = looked_up & ~matched
+        entry = self.references.setdefault(
+            name, {'source': source, 'keys': keys, 'looked_up': 0, 'orphans': 0, 'sample': []}
+        )
+        entry['looked_up'] += int(looked_up.sum())
+        entry['orphans'] += int(orphans.sum())
+
+        if len(entry['sample']) < self.SAMPLE_SIZE and orphans.any():
+            rows = np.flatnonzero(orphans)[:1000]
+            if positions is not None:
+                rows = positions[rows]
+            sample = frame[keys].iloc[rows].drop_duplicates()
+            if self.encoder is not None:
+                sample = self.encoder.decode(sample)
+            for key in sample.itertuples(index=False, name=None):
+                # Plain Python values, for readable log messages
+                key = tuple(v.item() if isinstance(v, np.generic) else v for v in key)
+                key = key[0] if len(keys) == 1 else key
+                if key not in entry['sample'] and len(entry['sample']) < self.SAMPLE_SIZE:
+                    entry['sample'].append(key)
+
+    def recount_references(self, storage: pd.DataFrame) -> None:
+        """
+        Replace self.references with the lookup counts of all `storage` rows.
+
+        Only resolves the row positions, without gathering any columns. Used
+        when this aggregator's join_storage did not see every row (reused
+        incremental rows, partition workers). Left empty when the join
+        engine cannot be used on the full tables.
+        """
+        self.references = {}
+        engine = self.join_engine()
+        if engine is not None and JoinEngine.encoded(storage, ['MaterialReference', 'Plant']):
+            engine.resolve(storage)
+            self.record_lookups(storage, engine)
+
+    @staticmethod
+    def lookup_join(result: pd.DataFrame, dimension: pd.DataFrame, key: str) -> pd.DataFrame:
+        """
+        Left-join a single-key name table by mapping the key column.
+
+        A table with one unique key and one value column (like the name
+        tables) is turned into a lookup Series and the value column is added
+        to `result` in place, instead of copying the whole frame as merge
+        does. Other tables are merged as usual.
+        """
+        value_cols = [c for c in dimension.columns if c != key]
+        if len(value_cols) != 1 or value_cols[0] in result.columns or not dimension[key].is_unique:
+            return result.merge(dimension, on=key, how='left')
+
+        value_col = value_cols[0]
+        keys = result[key]
+        dimension_keys = dimension[key]
+        if isinstance(dimension_keys.dtype, pd.CategoricalDtype):
+            dimension_keys = dimension_keys.astype(dimension_keys.cat.categories.dtype)
+        lookup = pd.Series(dimension[value_col].array, index=dimension_keys.array)
+
+        if isinstance(keys.dtype, pd.CategoricalDtype):
+            # Look up each category once and spread the values via the codes
+            per_category = lookup.reindex(keys.cat.categories)
+            result[value_col] = pd.api.extensions.take(
+                per_category.array, keys.cat.codes.to_numpy(), allow_fill=True
+            )
+        else:
+            result[value_col] = keys.map(lookup).array
+
+        return result
+
+    def _merge_dimensions(self, storage: pd.DataFrame) -> pd.DataFrame:
+        """Left-merge storage with the dimension tables following the join plan."""
+        if self._merge_plan is None:
+            self._merge_plan = self._plan_merges(len(storage))
+        dimensions, storage_joins = self._merge_plan
+
+        # Shallow copy: lookup joins add columns without touching `storage`
+        result = storage.copy(deep=False)
+        for name, keys in storage_joins:
+            result = self._join(result, dimensions[name], keys)
+
+        # Select and order columns
+        for col in Config.OUTPUT_COLUMNS:
+            if col not in result.columns:
+                result[col] = pd.NA
+        
+        # reindex returns a new frame (not a view), safe to update later
+        return result.reindex(columns=Config.OUTPUT_COLUMNS)
+
+    def _plan_merges(self, storage_rows: int) -> Tuple[Dict[str, pd.DataFrame], List]:
+        """Plan the merges and run the pre-joins among the dimensions once."""
+        dimensions = self._dimension_tables()
+        prejoins, storage_joins = JoinPlanner.plan(dimensions, storage_rows, self.JOIN_STEPS)
+        for into, name, keys in prejoins:
+            dimensions[into] = self._join(dimensions[into].copy(deep=False), dimensions[name], keys)
+
+        return dimensions, storage_joins
+
+    def _join(self, left: pd.DataFrame, right: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        """Left join, as a key lookup when `right` is a single-key name table."""
+        if len(keys) == 1:
+            return self.lookup_join(left, right, keys[0])
+        return left.merge(right, on=keys, how='left')
+
+    def aggregate(self) -> pd.DataFrame:
+        """Perform the complete aggregation process."""
+        logger.info("=" * 70)
+        logger.info("AGGREGATING DATA")
+        logger.info("=" * 70)
+        
+        try:
+            if 'storage' not in self.data:
+                raise ValueError("Storage data is required but not found")
+            
+            result = self.join_storage(self.data['storage'])
+            
+            logger.info(f"\nAggregation complete: {len(result)} rows, {len(result.columns)} columns")
+            logger.info("=" * 70)
+            logger.info("")
+            
+            return result
+            
+        except Exception as e:
+            logger.error(f"[ERROR] Aggregation failed: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            raise
+
+    def aggregate_partitioned(self, partitions: int) -> pd.DataFrame:
+        """
+        Aggregate with storage and plants hash-partitioned by Plant.
+
+        Plant is part of the output grain and the only storage key the
+        plants join needs besides MaterialReference, so each partition joins
+        independently. Partitions run in a process pool, each receiving its
+        storage and plants rows plus the other (small) dimension tables and
+        the primary suppliers selected once here. Results are put back in
+        storage row order, so the output equals aggregate(); if a join
+        multiplied rows, partitions are concatenated in partition order.
+        """
+        logger.info("=" * 70)
+        logger.info(f"AGGREGATING DATA ({partitions} PLANT PARTITIONS)")
+        logger.info("=" * 70)
+
+        try:
+            if 'storage' not in self.sources:
+                raise ValueError("Storage data is required but not found")
+
+            storage = self.sources['storage']
+            plants = self.sources.get('plants')
+            storage_parts = self.partition_by_plant(storage, partitions)
+            plant_parts = self.partition_by_plant(plants, partitions) if plants is not None else None
+
+            # Skip partitions without storage rows; empty results lose dtypes
+            used = [part for part in range(partitions) if len(storage_parts[part])]
+            if not used:
+                return self.aggregate()
+
+            # Broadcast tables: everything except the partitioned ones
+            shared = {name: df for name, df in self.sources.items() if name not in ('storage', 'plants')}
+            primary_suppliers = self.primary_suppliers()
+            if self.encoder is not None and not primary_suppliers.empty:
+                primary_suppliers = self.encoder.decode(primary_suppliers.copy(deep=False))
+
+            with ProcessPoolExecutor(max_workers=partitions) as executor:
+                futures = []
+                for part in used:
+                    tables = dict(shared)
+                    tables['storage'] = storage.iloc[storage_parts[part]]
+                    if plant_parts is not None:
+                        tables['plants'] = plants.iloc[plant_parts[part]]
+                    futures.append(executor.submit(
+                        aggregate_partition, tables, primary_suppliers, self.encoder is not None
+                    ))
+                results = [future.result() for future in futures]
+
+            for part, part_result in zip(used, results):
+                logger.info(f"  Partition {part}: {len(storage_parts[part])} storage rows → {len(part_result)} rows")
+
+            result = pd.concat(results, ignore_index=True)
+            if all(len(r) == len(storage_parts[part]) for part, r in zip(used, results)):
+                # One output row per storage row: restore storage order
+                order = np.argsort(np.concatenate([storage_parts[part] for part in used]), kind='stable')
+                result = result.take(order).reset_index(drop=True)
+
+            # Partitions choose between join engine and merges on their own
+            # rows; count the lookups once on the full tables instead
+            self.recount_references(self.data['storage'])
+
+            logger.info(f"\nAggregation complete: {len(result)} rows, {len(result.columns)} columns")
+            logger.info("=" * 70)
+            logger.info("")
+
+            return result
+
+        except Exception as e:
+            logger.error(f"[ERROR] Aggregation failed: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            raise
+
+    @staticmethod
+    def partition_by_plant(df: pd.DataFrame, partitions: int) -> List[np.ndarray]:
+        """Row positions of `df` per partition, by a hash of Plant."""
+        hashes = pd.util.hash_pandas_object(df['Plant'], index=False).to_numpy()
+        assignment = hashes % np.uint64(partitions)
+        return [np.flatnonzero(assignment == part) for part in range(partitions)]
+
+    def aggregate_chunks(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """
+        Aggregate storage delivered in chunks, yielding one result per chunk.
+
+        The dimension tables in self.data are loaded once and the primary
+        suppliers are selected once; each storage chunk then goes through
+        join_storage. Peak memory is the dimensions plus one chunk.
+        """
+        logger.info("=" * 70)
+        logger.info("AGGREGATING DATA (CHUNKED)")
+        logger.info("=" * 70)
+
+        total = 0
+        try:
+            for number, chunk in enumerate(chunks, start=1):
+                if self.encoder is not None:
+                    chunk = self._encode_chunk(chunk)
+                result = self.join_storage(chunk)
+                total += len(result)
+                logger.info(f"  Chunk {number}: {len(chunk)} storage rows → {len(result)} rows")
+                yield result
+
+        except Exception as e:
+            logger.error(f"[ERROR] Aggregation failed: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            raise
+
+        logger.info(f"\nAggregation complete: {total} rows, {len(Config.OUTPUT_COLUMNS)} columns")
+        logger.info("=" * 70)
+        logger.info("")
+
+    def _encode_chunk(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """
+        Encode a storage chunk's keys with the shared dictionaries.
+
+        Keys not seen in the dimension tables (orphan rows) are added to the
+        dictionaries first, and the dimensions are re-encoded so all tables
+        keep sharing one dtype per key.
+        """
+        if self.encoder.extend(chunk):
+            self.data = self.encoder.encode(self.data)
+            if self._primary_suppliers is not None:
+                self._primary_suppliers = self.encoder.encode({'p': self._primary_suppliers})['p']
+            # Key code ranges changed, rebuild the indexes and pre-joins
+            self._engine = None
+            self._merge_plan = None
+        return self.encoder.encode({'storage': chunk})['storage']
+
+
+def aggregate_partition(tables: Dict[str, pd.DataFrame], primary_suppliers: pd.DataFrame,
+                        encode_keys: bool) -> pd.DataFrame:
+    """Join one Plant partition; runs in a worker process."""
+    # Progress is reported by the parent process
+    logger.setLevel(logging.WARNING)
+    aggregator = MaterialDataAggregator(tables, encode_keys, primary_suppliers)
+    return aggregator.join_storage(aggregator.data['storage'])
+
+
+# ============================================================================
+# Incremental Aggregation
+# ============================================================================
+
+class IncrementalAggregator:
+    """
+    Re-aggregation that recomputes only rows affected by changed inputs.
+
+    The normalized inputs, per-row hashes and result of the last run are
+    kept in `state_folder`. A new run diffs each table's row hashes against
+    them: every inserted, changed or deleted dimension row marks its
+    material (or material and plant) as affected. Storage rows seen before
+    whose keys are unaffected reuse their previous output row; all other
+    rows go through join_storage. Anything that would break the
+    one-output-row-per-storage-row mapping falls back to a full rebuild.
+    """
+
+    STATE_VERSION = 1
+    STATE_FILE = "aggregation_state.pkl"
+
+    def __init__(self, state_folder: str):
+        self.state_path = Path(state_folder) / self.STATE_FILE
+
+    @staticmethod
+    def row_hashes(df: pd.DataFrame) -> np.ndarray:
+        """64-bit hash of every row's values."""
+        return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+    @classmethod
+    def variant(cls) -> str:
+        """Settings a stored state is only valid for."""
+        settings = repr((
+            cls.STATE_VERSION,
+            DataLoader.NORMALIZATION_VERSION,
+            Config.INPUT_SCHEMAS,
+            Config.OUTPUT_COLUMNS
+        ))
+        return hashlib.sha256(settings.encode()).hexdigest()[:16]
+
+    def load_state(self) -> Optional[Dict]:
+        """Previous run's state, or None if missing or not reusable."""
+        if not self.state_path.exists():
+            return None
+        try:
+            state = pd.read_pickle(self.state_path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable aggregation state: {str(e)}")
+            return None
+        if state.get('variant') != self.variant():
+            logger.info("  Aggregation state was built with other settings, ignoring it")
+            return None
+        return state
+
+    def save(self, dataframes: Dict[str, pd.DataFrame], result: pd.DataFrame) -> None:
+        """Persist the inputs and result of a completed run."""
+        state = {
+            'variant': self.variant(),
+            'tables': dataframes,
+            'hashes': {name: self.row_hashes(df) for name, df in dataframes.items()},
+            'result': result
+        }
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_path.with_suffix('.tmp')
+            pd.to_pickle(state, tmp)
+            tmp.replace(self.state_path)
+        except Exception as e:
+            logger.warning(f"Could not save aggregation state: {str(e)}")
+
+    @staticmethod
+    def changed_rows(old: pd.DataFrame, old_hashes: np.ndarray,
+                     new: pd.DataFrame, new_hashes: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Rows of `old` and of `new` whose hash the other table lacks."""
+        removed = old[~np.isin(old_hashes, new_hashes)]
+        added = new[~np.isin(new_hashes, old_hashes)]
+        return removed, added
+
+    def affected_keys(self, state: Dict, dataframes: Dict[str, pd.DataFrame],
+                      new_hashes: Dict[str, np.ndarray]) -> Optional[Tuple[pd.Series, pd.DataFrame]]:
+        """
+        Materials and (material, plant) pairs whose output may have changed.
+
+        Returns None if the dimension tables changed shape (other tables or
+        dtypes), in which case only a full rebuild is safe.
+        """
+        old_tables = state['tables']
+        if set(old_tables) != set(dataframes):
+            return None
+
+        materials = []
+        pairs = []
+        for name, df in dataframes.items():
+            if name == 'storage':
+                continue
+            old = old_tables[name]
+            if not old.dtypes.equals(df.dtypes):
+                return None
+            removed, added = self.changed_rows(old, state['hashes'][name], df, new_hashes[name])
+            if removed.empty and added.empty:
+                continue
+            logger.info(f"  {name}: {len(removed)} rows removed or changed, {len(added)} rows added or changed")
+            changed = pd.concat([removed, added], ignore_index=True)
+
+            if name == 'plants':
+                pairs.append(changed[['MaterialReference', 'Plant']])
+            elif name in ('materials', 'suppliers'):
+                materials.append(changed['MaterialReference'])
+            elif name == 'manufacturer_names' and 'materials' in dataframes:
+                referencing = dataframes['materials']['ManufacturerID'].isin(changed['ManufacturerID'])
+                materials.append(dataframes['materials'].loc[referencing, 'MaterialReference'])
+            elif name == 'supplier_names' and 'suppliers' in dataframes:
+                referencing = dataframes['suppliers']['SupplierID'].isin(changed['SupplierID'])
+                materials.append(dataframes['suppliers'].loc[referencing, 'MaterialReference'])
+
+        storage = dataframes['storage']
+        affected_materials = pd.concat(materials, ignore_index=True) if materials else storage['MaterialReference'].iloc[:0]
+        affected_pairs = pd.concat(pairs, ignore_index=True) if pairs else storage[['MaterialReference', 'Plant']].iloc[:0]
+        return affected_materials, affected_pairs
+
+    def aggregate(self, aggregator: MaterialDataAggregator, workers: int = 1) -> pd.DataFrame:
+        """Aggregate `aggregator`'s inputs, reusing the previous result where possible."""
+        dataframes = aggregator.sources
+        state = self.load_state()
+
+        def rebuild() -> pd.DataFrame:
+            if workers > 1:
+                return aggregator.aggregate_partitioned(workers)
+            return aggregator.aggregate()
+
+        if state is None or 'storage' not in dataframes:
+            logger.info("No previous aggregation state, running a full aggregation")
+            return rebuild()
+
+        logger.info("=" * 70)
+        logger.info("AGGREGATING DATA (INCREMENTAL)")
+        logger.info("=" * 70)
+
+        new_hashes = {name: self.row_hashes(df) for name, df in dataframes.items()}
+        affected = self.affected_keys(state, dataframes, new_hashes)
+        old_result = state['result']
+        old_storage_hashes = state['hashes'].get('storage')
+        if affected is None or old_storage_hashes is None or len(old_result) != len(old_storage_hashes) \
+                or not state['tables']['storage'].dtypes.equals(dataframes['storage'].dtypes):
+            logger.info("  Inputs changed shape, running a full aggregation")
+            return rebuild()
+        affected_materials, affected_pairs = affected
+
+        # Previous output row of every storage row seen before (-1 if new)
+        previous = pd.Series(np.arange(len(old_storage_hashes)), index=old_storage_hashes)
+        previous = previous[~previous.index.duplicated()]
+        found = previous.index.get_indexer(new_hashes['storage'])
+        old_positions = np.where(found >= 0, previous.to_numpy()[found], -1)
+
+        storage = dataframes['storage']
+        keys = storage[['MaterialReference', 'Plant']]
+        stale = storage['MaterialReference'].isin(affected_materials).to_numpy()
+        if len(affected_pairs):
+            stale = stale | np.isin(self.row_hashes(keys), self.row_hashes(affected_pairs))
+        recompute = (old_positions < 0) | stale
+        positions = np.flatnonzero(recompute)
+
+        logger.info(f"  Storage: {len(storage) - len(positions)} rows reused, {len(positions)} rows recomputed")
+
+        if len(positions) == 0:
+            result = old_result.take(old_positions).reset_index(drop=True)
+        else:
+            recomputed = aggregator.join_storage(aggregator.data['storage'].iloc[positions])
+            if len(recomputed) != len(positions):
+                logger.info("  Joins multiplied rows, running a full aggregation")
+                return rebuild()
+            # Reused rows index the old result, recomputed rows follow it
+            combined = pd.concat([old_result, recomputed], ignore_index=True)
+            source = old_positions.copy()
+            source[positions] = len(old_result) + np.arange(len(positions))
+            result = combined.take(source).reset_index(drop=True)
+
+        # Reused rows were not joined; count the lookups of every storage row
+        aggregator.recount_references(aggregator.data['storage'])
+
+        logger.info(f"\nAggregation complete: {len(result)} rows, {len(result.columns)} columns")
+        logger.info("=" * 70)
+        logger.info("")
+
+        return result
+
+
+# ============================================================================
+# SQLite Aggregation Backend
+# ============================================================================
+
+class SQLiteAggregator:
+    """
+    Out-of-core alternative to MaterialDataAggregator.
+
+    Normalized tables are bulk-loaded into an on-disk SQLite staging
+    database and indexed on their join keys. The joins of JOIN_STEPS and the
+    lowest-SupplierID rule then run as one SQL query whose cursor is read in
+    batches, so memory stays bounded by the batch size however large
+    storage is. Storage can be loaded chunk by chunk from
+    DataLoader.iter_batches.
+    """
+
+    def __init__(self, database_path: str, batch_size: Optional[int] = None):
+        self.database_path = Path(database_path)
+        self.batch_size = batch_size or Config.STREAM_BATCH_SIZE
+        # Columns of each loaded table, used to build the query
+        self.columns: Dict[str, List[str]] = {}
+
+        # Staging data is rebuilt on every run
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.database_path.exists():
+            self.database_path.unlink()
+        self.connection = sqlite3.connect(self.database_path)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+
+    @staticmethod
+    def quote(name: str) -> str:
+        return '"' + name.replace('"', '""') + '"'
+
+    def load_table(self, name: str, frames: Iterable[pd.DataFrame]) -> int:
+        """Append DataFrames to table `name`; returns the number of rows."""
+        rows = 0
+        for df in frames:
+            df.to_sql(name, self.connection, if_exists='append', index=False, chunksize=10000)
+            self.columns.setdefault(name, list(df.columns))
+            rows += len(df)
+        self.connection.commit()
+        logger.info(f"  Staged {name}: {rows} rows")
+        return rows
+
+    def create_indexes(self) -> None:
+        """Index every table on the keys it is looked up by."""
+        indexes = {name: keys for name, keys, _ in MaterialDataAggregator.JOIN_STEPS}
+        # Primary supplier selection scans suppliers per material by ID
+        indexes['suppliers'] = ['MaterialReference', 'SupplierID']
+
+        for name, keys in indexes.items():
+            if name in self.columns and all(k in self.columns[name] for k in keys):
+                columns = ', '.join(self.quote(k) for k in keys)
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.quote('idx_' + name)} ON {self.quote(name)} ({columns})"
+                )
+        self.connection.commit()
+
+    def query(self) -> str:
+        """The aggregation as one SELECT over the staged tables."""
+        q = self.quote
+        ctes = []
+        if 'suppliers' in self.columns:
+            # Lowest SupplierID per material, compared numerically, whole row
+            ctes.append(
+                f"primary_suppliers AS (SELECT * FROM (SELECT *, ROW_NUMBER() OVER ("
+                f"PARTITION BY {q('MaterialReference')} "
+                f"ORDER BY {q('SupplierID')} IS NULL, CAST({q('SupplierID')} AS INTEGER)) AS rank_ "
+                f"FROM suppliers WHERE {q('MaterialReference')} IS NOT NULL) WHERE rank_ = 1)"
+            )
+
+        joins = []
+        joined = ['storage']
+        for name, keys, source in MaterialDataAggregator.JOIN_STEPS:
+            if name not in self.columns or source not in joined:
+                continue
+            if not all(k in self.columns[source] for k in keys):
+                continue
+            relation = 'primary_suppliers' if name == 'suppliers' else q(name)
+            condition = ' AND '.join(f"{q(name)}.{q(k)} = {q(source)}.{q(k)}" for k in keys)
+            joins.append(f"LEFT JOIN {relation} AS {q(name)} ON {condition}")
+            joined.append(name)
+
+        padding = {
+            col: spec['pad']
+            for schema in Config.INPUT_SCHEMAS.values()
+            for col, spec in schema.items() if 'pad' in spec
+        }
+        select = []
+        for col in Config.OUTPUT_COLUMNS:
+            # Storage first, then dimensions in join order, as with merges
+            source = next((name for name in joined if col in self.columns[name]), None)
+            if source is None:
+                select.append(f"NULL AS {q(col)}")
+            elif col in padding:
+                value = f"{q(source)}.{q(col)}"
+                select.append(
+                    f"CASE WHEN {value} IS NULL THEN NULL "
+                    f"ELSE printf('%0{padding[col]}d', {value}) END AS {q(col)}"
+                )
+            else:
+                select.append(f"{q(source)}.{q(col)}")
+
+        with_clause = f"WITH {', '.join(ctes)} " if ctes else ""
+        return (
+            f"{with_clause}SELECT {', '.join(select)} FROM storage AS {q('storage')} "
+            f"{' '.join(joins)} ORDER BY {q('storage')}.rowid"
+        )
+
+    def aggregate_batches(self) -> Iterator[pd.DataFrame]:
+        """Run the aggregation query and yield the result in batches."""
+        logger.info("=" * 70)
+        logger.info("AGGREGATING DATA (SQLITE)")
+        logger.info("=" * 70)
+
+        if 'storage' not in self.columns:
+            raise ValueError("Storage data is required but not found")
+
+        self.create_indexes()
+        cursor = self.connection.execute(self.query())
+        total = 0
+        try:
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                total += len(rows)
+                yield pd.DataFrame.from_records(rows, columns=Config.OUTPUT_COLUMNS)
+        finally:
+            cursor.close()
+
+        logger.info(f"\nAggregation complete: {total} rows, {len(Config.OUTPUT_COLUMNS)} columns")
+        logger.info("=" * 70)
+        logger.info("")
+
+    def close(self) -> None:
+        self.connection.close()
+
+# ============================================================================
+# Logical Plan
+# ============================================================================
+
+class PlanNode:
+    """One operator of a logical plan with its inputs and estimated rows."""
+
+    def __init__(self, operator: str, detail: str = "", inputs: Optional[List['PlanNode']] = None,
+                 rows: Optional[float] = None):
+        self.operator = operator
+        self.detail = detail
+        self.inputs = inputs or []
+        self.rows = rows
+
+    def render(self, depth: int = 0) -> List[str]:
+        """The node and its inputs as indented lines, one per operator."""
+        label = f"{'  ' * depth}{self.operator} {self.detail}".rstrip()
+        rows = f"~{int(round(self.rows))} rows" if self.rows is not None else "? rows"
+        lines = [f"{label:<90} {rows}"]
+        for node in self.inputs:
+            lines.extend(node.render(depth + 1))
+        return lines
+
+
+class LazyAggregation:
+    """
+    The aggregation as a lazy logical plan.
+
+    select() and filter() only record what is wanted. plan() builds the
+    optimized plan from file headers and row counts without reading any
+    data, and collect() executes it. The optimizer
+      - pushes the projection into the scans, so each file is read with
+        the requested columns it provides plus the join keys it needs,
+      - pushes filters on storage columns below the joins (a storage row
+        keeps or drops all its output rows together); filters on padded
+        keys and on other columns run on the joined rows,
+      - drops joins none of whose columns are requested, unless a kept
+        join takes its key from them. A join whose keys repeat multiplies
+        rows, so collect() reads the keys of dropped tables and keeps the
+        ones with duplicates,
+      - uses one material dimension lookup in place of the material joins
+        when all of MATERIAL_TABLES are kept, as join_storage does.
+    Row estimates assume unique dimension keys and fixed filter
+    selectivities. Filter values are compared with output values, e.g.
+    Plant as the padded text '0030'.
+    """
+
+    FILTER_OPERATORS = {
+        '==': operator.eq,
+        '!=': operator.ne,
+        '<': operator.lt,
+        '<=': operator.le,
+        '>': operator.gt,
+        '>=': operator.ge,
+        'in': lambda values, allowed: values.isin(allowed),
+        'not in': lambda values, excluded: ~values.isin(excluded)
+    }
+
+    # Fraction of rows a filter is assumed to keep ('in' is per value)
+    SELECTIVITY = {'==': 0.1, '!=': 0.9, '<': 1 / 3, '<=': 1 / 3, '>': 1 / 3, '>=': 1 / 3,
+                   'in': 0.1, 'not in': 0.9}
+
+    def __init__(self, input_folder: str, file_mapping: Optional[Dict[str, str]] = None,
+                 max_workers: int = 1, cache: Optional[ParsedFileCache] = None,
+                 schemas: Optional[Dict[str, Dict]] = None,
+                 dimension_cache: Optional[MaterialDimensionCache] = None):
+        self.input_folder = Path(input_folder)
+        self.file_mapping = dict(file_mapping or Config.INPUT_FILES)
+        self.max_workers = max_workers
+        self.cache = cache
+        self.schemas = schemas or {}
+        self.dimension_cache = dimension_cache
+        self.columns = list(Config.OUTPUT_COLUMNS)
+        # (column, operator, value) in the order they were added
+        self.filters: List[Tuple[str, str, object]] = []
+        # Header and row count per table, read on first use
+        self._inspected: Optional[Dict[str, Tuple[List, Optional[int]]]] = None
+
+    def select(self, *columns: str) -> 'LazyAggregation':
+        """Plan restricted to `columns` of Config.OUTPUT_COLUMNS."""
+        unknown = [col for col in columns if col not in Config.OUTPUT_COLUMNS]
+        if unknown:
+            raise ValueError(f"Not output columns: {unknown}")
+        derived = copy.copy(self)
+        derived.columns = list(columns)
+        return derived
+
+    def filter(self, column: str, op: str, value) -> 'LazyAggregation':
+        """Plan keeping only rows where `column op value` holds."""
+        if op not in self.FILTER_OPERATORS:
+            raise ValueError(f"Unknown filter operator {op!r}, expected one of {list(self.FILTER_OPERATORS)}")
+        derived = copy.copy(self)
+        derived.filters = self.filters + [(column, op, value)]
+        return derived
+
+    def inspect(self) -> Dict[str, Tuple[List, Optional[int]]]:
+        """Header and row count of every input file (metadata only)."""
+        if self._inspected is None:
+            inspected = {}
+            for table, filename in self.file_mapping.items():
+                file_path = self.input_folder / filename
+                if not file_path.exists():
+                    raise FileNotFoundError(f"File not found: {file_path}")
+                inspected[table] = input_format(file_path).inspect(file_path)
+            self._inspected = inspected
+        return self._inspected
+
+    def optimize(self, keep: Iterable[str] = ()) -> Dict:
+        """
+        Apply the rewrite rules.
+
+        Tables in `keep` are joined even without requested columns. Returns
+        the kept join steps, the pruned tables, the columns each scan reads,
+        and the filters pushed into the storage scan and left above the
+        joins.
+        """
+        headers = {table: header for table, (header, _) in self.inspect().items()}
+        if 'storage' not in headers:
+            raise ValueError("Storage data is required but not found")
+
+        # Source of each column: storage first, then tables in join order
+        order = ['storage'] + [name for name, _, _ in MaterialDataAggregator.JOIN_STEPS]
+
+        def provider(column: str) -> Optional[str]:
+            return next((table for table in order if table in headers and column in headers[table]), None)
+
+        # Padded keys differ from their input values until format_output
+        padded = {col for schema in Config.INPUT_SCHEMAS.values()
+                  for col, spec in schema.items() if 'pad' in spec}
+
+        def pushable(column: str) -> bool:
+            return provider(column) == 'storage' and column not in padded
 
-def setup_logging():
-    """Configure logging to file and console."""
-    log_folder = Path(Config.LOG_FOLDER)
-    log_folder.mkdir(parents=True, exist_ok=True)
-    
-    log_file = log_folder / f"aggregation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+        pushed = [f for f in self.filters if pushable(f[0])]
+        residual = [f for f in self.filters if not pushable(f[0])]
+        for column, _, _ in residual:
+            if column not in Config.OUTPUT_COLUMNS or provider(column) is None:
+                raise ValueError(f"Cannot filter on {column}: not found in the output or storage")
 
-logger = setup_logging()
+        wanted = {col: provider(col) for col in self.columns + [f[0] for f in residual]}
+        kept = {table for table in wanted.values() if table not in (None, 'storage')}
+        kept.update(keep)
+        # A kept lookup needs the table its key comes from
+        for name, _, source in reversed(MaterialDataAggregator.JOIN_STEPS):
+            if name in kept and source != 'storage':
+                kept.add(source)
+        steps = [step for step in MaterialDataAggregator.JOIN_STEPS if step[0] in kept]
 
-# ============================================================================
-# Data Loader
-# ============================================================================
+        needed = {table: set() for table in ['storage'] + [name for name, _, _ in steps]}
+        for col, table in wanted.items():
+            if table is not None:
+                needed[table].add(col)
+        for column, _, _ in pushed:
+            needed['storage'].add(column)
+        for name, keys, source in steps:
+            needed[name].update(keys)
+            needed[source].update(keys)
+        if 'suppliers' in needed:
+            # The primary supplier reduction
+            needed['suppliers'].update(['MaterialReference', 'SupplierID'])
 
-class DataLoader:
-    """Handles loading Excel files from the input folder."""
-    
-    def __init__(self, input_folder: str):
-        self.input_folder = Path(input_folder)
-        
-    def load_file(self, filename: str) -> Optional[pd.DataFrame]:
-        """Load a single Excel file."""
-        file_path = self.input_folder / filename
-        
-        try:
-            if not file_path.exists():
-                logger.error(f"File not found: {file_path}")
-                return None
-            
-            df = pd.read_excel(file_path, engine='openpyxl')
-            
-            for col in df.columns:
-
-                # Trim whitespace
-                if df[col].dtype == 'object':
-                    df[col] = df[col].astype(str).str.strip()
-                    df[col] = df[col].replace('nan', pd.NA)
-
-                # Preserve leading zeros for Plant
-                if col == 'Plant':
-                    df[col] = (
-                        df[col]
-                        .where(df[col].notna(), pd.NA)
-                        .astype(str)
-                        .str.replace(r'\.0$', '', regex=True)
-                        .str.zfill(4)
-                        .replace('000nan', pd.NA)
-                    )
+        return {
+            'steps': steps,
+            'pruned': [name for name, _, _ in MaterialDataAggregator.JOIN_STEPS
+                       if name in headers and name not in kept],
+            'scan_columns': {table: [col for col in headers[table] if col in cols]
+                             for table, cols in needed.items()},
+            'pushed': pushed,
+            'residual': residual
+        }
 
-                if col in ['SupplierID', 'ManufacturerID']:
-                    df[col] = (
-                        df[col]
-                        .where(df[col].notna(), pd.NA)
-                        .astype(str)
-                        .str.replace(r'\.0$', '', regex=True)
-                        .str.strip()
-                    )
+    def _filter_nodes(self, node: PlanNode, filters: List, label: str) -> PlanNode:
+        for column, op, value in filters:
+            selectivity = self.SELECTIVITY[op] * (len(value) if op == 'in' else 1)
+            rows = node.rows * min(selectivity, 1) if node.rows is not None else None
+            node = PlanNode('Filter', f"{column} {op} {value!r}{label}", [node], rows)
+        return node
+
+    def plan(self) -> PlanNode:
+        """The optimized logical plan with estimated row counts."""
+        optimized = self.optimize()
+        inspected = self.inspect()
+        steps = optimized['steps']
+
+        def scan(table: str) -> PlanNode:
+            columns = optimized['scan_columns'][table]
+            node = PlanNode('Scan', f"{self.file_mapping[table]} {columns}", rows=inspected[table][1])
+            casts = [f"{col}:{spec['dtype']}" for col, spec in self.schemas.get(table, {}).items() if col in columns]
+            detail = f"cast {', '.join(casts)}, trim text" if casts else "trim text, repair keys"
+            return PlanNode('Normalize', detail, [node], node.rows)
+
+        dimensions = {name: scan(name) for name, _, _ in steps}
+        if 'suppliers' in dimensions:
+            suppliers = dimensions['suppliers']
+            rows = suppliers.rows
+            if 'materials' in dimensions and rows is not None and dimensions['materials'].rows is not None:
+                rows = min(rows, dimensions['materials'].rows)
+            dimensions['suppliers'] = PlanNode(
+                'PrimarySupplier', "lowest SupplierID per MaterialReference [idxmin]", [suppliers], rows
+            )
+
+        # Lookups keyed by another dimension resolve through that dimension
+        for name, keys, source in steps:
+            if source != 'storage':
+                left = dimensions[source]
+                dimensions[source] = PlanNode(
+                    'LeftJoin', f"{name} on {keys} [position lookup via {source}]",
+                    [left, dimensions.pop(name)], left.rows
+                )
+
+        storage_steps = [(name, keys) for name, keys, source in steps if source == 'storage']
+        material = [name for name, _ in storage_steps if name in MaterialDataAggregator.MATERIAL_TABLES]
+        kept = {name for name, _, _ in steps}
+        if all(table in kept for table in MaterialDataAggregator.MATERIAL_TABLES):
+            inputs = [dimensions.pop(name) for name in material]
+            rows = max((node.rows for node in inputs if node.rows is not None), default=None)
+            dimensions['material_dimension'] = PlanNode(
+                'MaterialDimension', "on ['MaterialReference'] [built once, cached]", inputs, rows
+            )
+            storage_steps = [('material_dimension', ['MaterialReference'])] + \
+                [(name, keys) for name, keys in storage_steps if name not in material]
+
+        node = self._filter_nodes(scan('storage'), optimized['pushed'], " [pushed down]")
+        for name, keys in storage_steps:
+            node = PlanNode('LeftJoin', f"{name} on {keys} [position lookup]", [node, dimensions[name]], node.rows)
+        node = self._filter_nodes(node, optimized['residual'], "")
+        return PlanNode('Project', f"{self.columns} [decode keys, pad]", [node], node.rows)
+
+    def explain(self) -> str:
+        """Log the optimized plan with estimated row counts and return it."""
+        lines = self.plan().render()
+        pruned = self.optimize()['pruned']
+        if pruned:
+            lines.append(f"Pruned joins (no requested columns, kept if their keys repeat): {', '.join(pruned)}")
 
-            
-            logger.info(f"Loaded {filename}: {len(df)} rows, {len(df.columns)} columns")
-            return df
-            
-        except Exception as e:
-            logger.error(f"[ERROR] Error loading {filename}: {str(e)}")
-            return None
-    
-    def load_all(self, file_mapping: Dict[str, str]) -> Tuple[Dict[str, pd.DataFrame], bool]:
-        """Load all required files."""
         logger.info("=" * 70)
-        logger.info("LOADING INPUT FILES")
+        logger.info("AGGREGATION PLAN")
         logger.info("=" * 70)
-        
-        dataframes = {}
-        all_loaded = True
-        # File Error handling
-        for data_type, filename in file_mapping.items():
-            df = self.load_file(filename)
-            if df is None:
-                all_loaded = False
-                logger.error(f"Failed to load required file: {filename}")
-            else:
-                dataframes[data_type] = df
-        
-        if all_loaded:
-            logger.info("All files loaded successfully\n")
-        else:
-            logger.error("[ERROR] Some files failed to load\n")
-        
-        return dataframes, all_loaded
+        for line in lines:
+            logger.info(line)
+        logger.info("")
+        return "\n".join(lines)
+
+    @classmethod
+    def apply_filters(cls, df: pd.DataFrame, filters: List[Tuple[str, str, object]]) -> pd.DataFrame:
+        """Rows of `df` passing every filter; NA never passes."""
+        for column, op, value in filters:
+            mask = pd.Series(cls.FILTER_OPERATORS[op](df[column], value), index=df.index)
+            df = df[mask.fillna(False).astype(bool)].reset_index(drop=True)
+        return df
+
+    def multiplying_joins(self, pruned: List[str]) -> List[str]:
+        """
+        Tables of `pruned` whose join keys repeat.
+
+        Eager aggregation merges such a table, repeating a storage row per
+        match, so dropping the join would lose rows. Only the keys are read.
+        Suppliers are reduced to one primary supplier per material first,
+        so they never repeat.
+        """
+        steps = [(name, keys) for name, keys, _ in MaterialDataAggregator.JOIN_STEPS
+                 if name in pruned and name != 'suppliers']
+        if not steps:
+            return []
+
+        loader = DataLoader(
+            self.input_folder,
+            cache=self.cache,
+            columns={key for _, keys in steps for key in keys},
+            schemas=self.schemas
+        )
+        dataframes, success = loader.load_all({name: self.file_mapping[name] for name, _ in steps})
+        if not success:
+            raise ValueError("Failed to load all required files")
+
+        return [name for name, keys in steps
+                if all(key in dataframes[name].columns for key in keys)
+                and PackedKeys(dataframes[name], keys).duplicated().any()]
+
+    def collect(self) -> pd.DataFrame:
+        """Execute the optimized plan and return the result."""
+        optimized = self.optimize()
+        multiplying = self.multiplying_joins(optimized['pruned'])
+        if multiplying:
+            logger.info(f"Keeping pruned joins with duplicate keys: {', '.join(multiplying)}")
+            optimized = self.optimize(keep=multiplying)
+        scan_columns = optimized['scan_columns']
+
+        loader = DataLoader(
+            self.input_folder,
+            max_workers=self.max_workers,
+            cache=self.cache,
+            columns=set().union(*scan_columns.values()),
+            schemas=self.schemas
+        )
+        dataframes, success = loader.load_all({table: self.file_mapping[table] for table in scan_columns})
+        if not success:
+            raise ValueError("Failed to load all required files")
+
+        # The loader projects on the union of all scans; narrow each table
+        for table, columns in scan_columns.items():
+            dataframes[table] = dataframes[table][[col for col in columns if col in dataframes[table].columns]]
+        dataframes['storage'] = self.apply_filters(dataframes['storage'], optimized['pushed'])
+
+        aggregator = MaterialDataAggregator(dataframes, dimension_cache=self.dimension_cache)
+        result = self.apply_filters(aggregator.aggregate(), optimized['residual'])
+        return result[self.columns]
 
 # ============================================================================
-# Data Aggregator
+# Key Packing
 # ============================================================================
 
-class MaterialDataAggregator:
-    """Aggregates material data from multiple sources."""
-    
-    def __init__(self, dataframes: Dict[str, pd.DataFrame]):
-        self.data = dataframes
-        
-    def get_primary_suppliers(self) -> pd.DataFrame:
+class PackedKeys:
+    """
+    The columns of a grain packed into one comparable key per row.
 
-        if 'suppliers' not in self.data:
-            logger.warning("Suppliers data not available")
-            return pd.DataFrame()
-        
-        suppliers = self.data['suppliers'].copy()
-        
-        suppliers['SupplierID_int'] = suppliers['SupplierID'].astype(int)
-        
-        # Sort by SupplierID and take first (lowest) per material
-        suppliers_sorted = suppliers.sort_values('SupplierID_int')
-        primary_suppliers = suppliers_sorted.groupby('MaterialReference').first().reset_index()
-        
-        primary_suppliers = primary_suppliers.drop('SupplierID_int', axis=1)
-        
-        logger.info(f"  Selected primary supplier (lowest ID) from {len(suppliers)} records → {len(primary_suppliers)} materials")
-        return primary_suppliers
-    
-    def aggregate(self) -> pd.DataFrame:
-        """Perform the complete aggregation process."""
-        logger.info("=" * 70)
-        logger.info("AGGREGATING DATA")
-        logger.info("=" * 70)
-        
-        try:
-            if 'storage' not in self.data:
-                raise ValueError("Storage data is required but not found")
-            
-            result = self.data['storage'].copy()
-            # logger.info(f"Step 1: Base table (storage) - {len(result)} rows")
-            
-            # Add materials data
-            if 'materials' in self.data:
-                before = len(result)
-                result = result.merge(
-                    self.data['materials'],
-                    on='MaterialReference',
-                    how='left'
-                )
-                # logger.info(f"Step 2: Merge materials - {before} → {len(result)} rows")
-            
-            # Add manufacturer names
-            if 'manufacturer_names' in self.data:
-                before = len(result)
-                result = result.merge(
-                    self.data['manufacturer_names'],
-                    on='ManufacturerID',
-                    how='left'
-                )
-                # logger.info(f"Step 3: Merge manufacturer names - {before} → {len(result)} rows")
-            
-            # Add plant data
-            if 'plants' in self.data:
-                before = len(result)
-                result = result.merge(
-                    self.data['plants'],
-                    on=['MaterialReference', 'Plant'],
-                    how='left'
-                )
-                # logger.info(f"Step 4: Merge plants - {before} → {len(result)} rows")
-            
-            # Add primary supplier data
-            primary_suppliers = self.get_primary_suppliers()
-            if not primary_suppliers.empty:
-                before = len(result)
-                result = result.merge(
-                    primary_suppliers,
-                    on='MaterialReference',
-                    how='left'
-                )
-                # logger.info(f"Step 5: Merge primary suppliers - {before} → {len(result)} rows")
-            
-            # Add supplier names lookup
-            if 'supplier_names' in self.data and 'SupplierID' in result.columns:
-                before = len(result)
-                result = result.merge(
-                    self.data['supplier_names'],
-                    on='SupplierID',
-                    how='left'
-                )
-                # logger.info(f"Step 6: Add supplier names - {before} → {len(result)} rows")
-            
-            # Select and order columns
-            for col in Config.OUTPUT_COLUMNS:
-                if col not in result.columns:
-                    result[col] = pd.NA
-            
-            result = result[Config.OUTPUT_COLUMNS]
-            
-            logger.info(f"\nAggregation complete: {len(result)} rows, {len(result.columns)} columns")
-            logger.info("=" * 70)
-            logger.info("")
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"[ERROR] Aggregation failed: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            raise
+    Each column is factorized and the codes (shifted so NA is 0) are
+    combined in mixed radix into one int64. When the product of the column
+    cardinalities does not fit, the code rows are hashed into a 128-bit key
+    (two independent 64-bit hashes) instead. Duplicates are then found with
+    one bincount (small key ranges) or one sort; only if keys repeat are
+    the repeated rows located with an argsort. Rows with NULLs in the grain
+    fall out of the same factorization.
+    """
+
+    # Largest key range counted with bincount instead of sorting
+    BINCOUNT_LIMIT = 1 << 22
+
+    def __init__(self, df: pd.DataFrame, keys: List[str]):
+        codes = []
+        sizes = []
+        for key in keys:
+            column_codes, uniques = pd.factorize(df[key])
+            codes.append(column_codes.astype(np.int64) + 1)
+            sizes.append(len(uniques) + 1)
+
+        n = len(df)
+        # Rows with NA (code 0) in any grain column
+        self.nulls = np.zeros(n, dtype=bool)
+        for column_codes in codes:
+            self.nulls |= column_codes == 0
+
+        space = 1
+        for size in sizes:
+            space *= size
+        # Second half of a 128-bit hash key, None for packed codes
+        self.low: Optional[np.ndarray] = None
+        if space < 2**63:
+            self.space: Optional[int] = space
+            self.values = np.zeros(n, dtype=np.int64)
+            for column_codes, size in zip(codes, sizes):
+                self.values = self.values * size + column_codes
+        else:
+            self.space = None
+            matrix = pd.DataFrame({i: c for i, c in enumerate(codes)})
+            self.values = pd.util.hash_pandas_object(matrix, index=False, hash_key='grain-key-high00').to_numpy()
+            self.low = pd.util.hash_pandas_object(matrix, index=False, hash_key='grain-key-low000').to_numpy()
+
+    @property
+    def null_count(self) -> int:
+        return int(self.nulls.sum())
+
+    def duplicated(self) -> np.ndarray:
+        """Mask of rows whose key occurs more than once (like keep=False)."""
+        if self.space is not None and self.space <= max(self.BINCOUNT_LIMIT, 4 * len(self.values)):
+            counts = np.bincount(self.values, minlength=self.space)
+            return counts[self.values] > 1
+
+        return self.repeated(self.values, self.low)
+
+    @staticmethod
+    def repeated(values: np.ndarray, low: Optional[np.ndarray] = None) -> np.ndarray:
+        """Mask of rows whose key (values, plus `low` for 128-bit keys) repeats."""
+        # Equal keys have equal values (or high hash halves): a plain sort
+        # settles the common case of no duplicates
+        ordered = np.sort(values)
+        if not (ordered[1:] == ordered[:-1]).any():
+            return np.zeros(len(values), dtype=bool)
+
+        if low is None:
+            order = np.argsort(values)
+            ordered = values[order]
+            same = ordered[1:] == ordered[:-1]
+        else:
+            order = np.lexsort((low, values))
+            high, low = values[order], low[order]
+            same = (high[1:] == high[:-1]) & (low[1:] == low[:-1])
+        duplicated = np.zeros(len(order), dtype=bool)
+        duplicated[1:] |= same
+        duplicated[:-1] |= same
+        result = np.empty_like(duplicated)
+        result[order] = duplicated
+        return result
+
+class SpilledDuplicateDetector:
+    """
+    Bounded-memory duplicate check of a grain over a stream of chunks.
+
+    Factorized codes are only comparable within one frame, so each row's
+    grain is hashed by value to 128 bits (two 64-bit hashes) instead, and
+    appended with its row number to one of `partitions` files in
+    `spill_folder` chosen by the hash. Equal keys always land in the same
+    file, so finish() checks one partition at a time, holding about
+    24 bytes per row of the largest partition. Values are hashed in their
+    text form, so a key parsed as 1 in one chunk and '1' in another is the
+    same key, as in a full load. Duplicates are never missed; distinct keys
+    could only be reported by a 128-bit collision.
+    """
+
+    RECORD = np.dtype([('high', np.uint64), ('low', np.uint64), ('row', np.int64)])
+
+    def __init__(self, keys: List[str], spill_folder: str, partitions: int = 64):
+        self.keys = keys
+        self.partitions = partitions
+        Path(spill_folder).mkdir(parents=True, exist_ok=True)
+        self._directory = tempfile.TemporaryDirectory(dir=spill_folder, prefix='grain-')
+        self.paths = [Path(self._directory.name) / f"partition-{i:03d}.bin" for i in range(partitions)]
+        # Rows added so far; row numbers count across chunks
+        self.rows = 0
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        """Hash the grain of `chunk` and append it to the partition files."""
+        # Chunks may infer other types for the same values: hash the text,
+        # as objects so every kind of NA hashes alike
+        grain = pd.DataFrame({key: DataLoader._as_text(chunk[key]).astype(object) for key in self.keys})
+        records = np.empty(len(chunk), dtype=self.RECORD)
+        records['high'] = pd.util.hash_pandas_object(grain, index=False, hash_key='grain-spill-high').to_numpy()
+        records['low'] = pd.util.hash_pandas_object(grain, index=False, hash_key='grain-spill-low0').to_numpy()
+        records['row'] = np.arange(self.rows, self.rows + len(chunk))
+        self.rows += len(chunk)
+
+        partition = records['high'] % np.uint64(self.partitions)
+        order = np.argsort(partition, kind='stable')
+        bounds = np.searchsorted(partition[order], np.arange(self.partitions + 1))
+        for i in range(self.partitions):
+            if bounds[i] < bounds[i + 1]:
+                with open(self.paths[i], 'ab') as f:
+                    records[order[bounds[i]:bounds[i + 1]]].tofile(f)
+
+    def finish(self, sample_size: int = 5) -> Tuple[int, List[int]]:
+        """Number of rows with a repeated grain and the first such row numbers."""
+        duplicates = 0
+        sample: List[int] = []
+        for path in self.paths:
+            if not path.exists():
+                continue
+            records = np.fromfile(path, dtype=self.RECORD)
+            repeated = PackedKeys.repeated(records['high'], records['low'])
+            if repeated.any():
+                duplicates += int(repeated.sum())
+                sample = sorted(sample + records['row'][repeated].tolist())[:sample_size]
+        return duplicates, sample
+
+    def close(self) -> None:
+        """Delete the partition files."""
+        self._directory.cleanup()
+
+class BloomDuplicateChecker:
+    """
+    Two-phase duplicate check of a grain in little memory.
+
+    The first pass hashes the grain by value block by block and inserts
+    every key into a Bloom filter of `bits_per_key` bits per row; keys
+    whose bits were all set already (or that repeat within their block)
+    are candidates. The second pass rehashes, keeps only rows whose hash
+    is a candidate and checks those exactly with PackedKeys. Memory is the
+    filter plus the candidates and one block, instead of the per-row codes
+    of PackedKeys over the whole result; at 10 bits per key about 1% of
+    unique keys become candidates. Hashing twice makes it slower.
+    """
+
+    def __init__(self, keys: List[str], bits_per_key: int = 10, block_size: int = 250_000):
+        self.keys = keys
+        self.bits_per_key = bits_per_key
+        self.block_size = block_size
+        # Probes per key giving the fewest false positives for the filter size
+        self.hash_count = max(1, round(bits_per_key * np.log(2)))
+
+    @staticmethod
+    def _hash(block: pd.DataFrame) -> np.ndarray:
+        return pd.util.hash_pandas_object(block, index=False, hash_key='grain-bloom-key0').to_numpy()
+
+    def _probes(self, key_hash: np.ndarray, mask: np.uint64) -> Iterator[np.ndarray]:
+        """Filter bit positions of each key by double hashing one 64-bit hash."""
+        # Odd step derived from the hash, so probes of a key never coincide
+        step = (key_hash * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32) | np.uint64(1)
+        for i in range(self.hash_count):
+            yield (key_hash + np.uint64(i) * step) & mask
 
+    def check(self, df: pd.DataFrame) -> Tuple[int, np.ndarray]:
+        """Number of rows whose grain repeats, and their positions in `df`."""
+        grain = df[self.keys]
+        if grain.empty:
+            return 0, np.empty(0, dtype=np.int64)
+
+        size = 64
+        while size < len(grain) * self.bits_per_key:
+            size <<= 1
+        mask = np.uint64(size - 1)
+        bloom = np.zeros(size // 8, dtype=np.uint8)
+
+        candidates = []
+        for start in range(0, len(grain), self.block_size):
+            key_hash = self._hash(grain.iloc[start:start + self.block_size])
+            present = np.ones(len(key_hash), dtype=bool)
+            for probe in self._probes(key_hash, mask):
+                present &= ((bloom[probe >> 3] >> (probe & 7)) & 1).astype(bool)
+            # Keys are looked up before the block is inserted, so repeats
+            # inside the block are found separately
+            flagged = present | PackedKeys.repeated(key_hash)
+            for probe in self._probes(key_hash, mask):
+                np.bitwise_or.at(bloom, probe >> 3, (1 << (probe & 7)).astype(np.uint8))
+            candidates.append(key_hash[flagged])
+        candidates = np.unique(np.concatenate(candidates))
+        del bloom
+
+        # First occurrences were not flagged: collect all rows of candidate keys
+        rows = np.concatenate([
+            start + np.flatnonzero(np.isin(self._hash(grain.iloc[start:start + self.block_size]), candidates))
+            for start in range(0, len(grain), self.block_size)
+        ])
+        repeated = PackedKeys(grain.iloc[rows], self.keys).duplicated()
+        return int(repeated.sum()), rows[repeated]
 
 # ============================================================================
 # Data Validator
 # ============================================================================
 
+class ValidationError(ValueError):
+    """Result data failed validation while being streamed to the output."""
+
+
 class DataValidator:
     """
     Validates both source data integrity and final output.
@@ -301,26 +2544,39 @@ class DataValidator:
     }
 
     @staticmethod
-    def validate_sources(dataframes: Dict[str, pd.DataFrame]) -> None:
+    def check_source(name: str, df: pd.DataFrame, keys: List[str]) -> List[Tuple[int, str]]:
+        """Duplicate check of one source table, as (level, message) records."""
+        duplicates = PackedKeys(df, keys).duplicated()
+        if duplicates.any():
+            return [(logging.WARNING, f"{name}: {duplicates.sum()} duplicate rows detected on key {keys}")]
+        return [(logging.INFO, f"{name}: no duplicates on key {keys}")]
+
+    @staticmethod
+    def validate_sources(dataframes: Dict[str, pd.DataFrame], max_workers: int = 1) -> None:
         """
         Detect duplicate rows on expected source keys.
+
+        With max_workers > 1 the tables are checked concurrently in a thread
+        pool (factorizing and sorting release the GIL, and the tables are
+        shared rather than pickled). Each check returns its messages, which
+        are logged in SOURCE_GRAINS order once all checks are done.
         """
         logger.info("=" * 70)
         logger.info("VALIDATING SOURCE DATA")
         logger.info("=" * 70)
 
-        for name, keys in DataValidator.SOURCE_GRAINS.items():
-            df = dataframes.get(name)
-            if df is None:
-                continue
+        checks = [(name, dataframes[name], keys)
+                  for name, keys in DataValidator.SOURCE_GRAINS.items() if name in dataframes]
 
-            duplicates = df.duplicated(subset=keys, keep=False)
-            if duplicates.any():
-                logger.warning(
-                    f"{name}: {duplicates.sum()} duplicate rows detected on key {keys}"
-                )
-            else:
-                logger.info(f"{name}: no duplicates on key {keys}")
+        if max_workers > 1 and len(checks) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(checks))) as executor:
+                reports = list(executor.map(lambda check: DataValidator.check_source(*check), checks))
+        else:
+            reports = [DataValidator.check_source(*check) for check in checks]
+
+        for records in reports:
+            for level, message in records:
+                logger.log(level, message)
 
         logger.info("=" * 70)
         logger.info("")
@@ -343,19 +2599,31 @@ class DataValidator:
         if missing_cols:
             issues.append(f"Missing output columns: {missing_cols}")
 
+        if Config.BLOOM_GRAIN_CHECK:
+            null_rows = np.zeros(len(df), dtype=bool)
+            for key in DataValidator.FINAL_GRAIN:
+                null_rows |= df[key].isna().to_numpy()
+            null_count = int(null_rows.sum())
+            duplicates, _ = BloomDuplicateChecker(
+                DataValidator.FINAL_GRAIN, Config.BLOOM_BITS_PER_KEY
+            ).check(df)
+        else:
+            # One packed key serves the NULL and duplicate checks
+            grain = PackedKeys(df, DataValidator.FINAL_GRAIN)
+            null_count = grain.null_count
+            duplicates = int(grain.duplicated().sum())
+
         # NULLs in final grain
-        null_keys = df[DataValidator.FINAL_GRAIN].isna().any(axis=1)
-        if null_keys.any():
+        if null_count:
             issues.append(
-                f"{null_keys.sum()} rows have NULLs in final grain keys "
+                f"{null_count} rows have NULLs in final grain keys "
                 f"{DataValidator.FINAL_GRAIN}"
             )
 
         # Duplicate final grain rows
-        duplicates = df.duplicated(subset=DataValidator.FINAL_GRAIN, keep=False)
-        if duplicates.any():
+        if duplicates:
             issues.append(
-                f"{duplicates.sum()} Duplicate rows detected "
+                f"{duplicates} Duplicate rows detected "
                 f"{DataValidator.FINAL_GRAIN}"
             )
 
@@ -370,6 +2638,83 @@ class DataValidator:
         logger.info("")
         return True
 
+    @staticmethod
+    def validate_references(references: Dict[str, Dict]) -> None:
+        """
+        Report keys without a match in each lookup of the aggregation.
+
+        `references` are the counts MaterialDataAggregator collects from the
+        join engine's match bitmaps while joining (see record_lookups), so
+        no anti-joins are needed. Orphans are warnings, like duplicates.
+        """
+        logger.info("=" * 70)
+        logger.info("VALIDATING REFERENCES")
+        logger.info("=" * 70)
+
+        if not references:
+            logger.info("No lookup statistics recorded")
+        for name, entry in references.items():
+            relationship = f"{entry['source']} → {name} on {entry['keys']}"
+            if entry['orphans']:
+                logger.warning(
+                    f"{relationship}: {entry['orphans']} of {entry['looked_up']} storage rows "
+                    f"have no match, e.g. {entry['sample']}"
+                )
+            else:
+                logger.info(f"{relationship}: all {entry['looked_up']} storage rows matched")
+
+        logger.info("=" * 70)
+        logger.info("")
+
+    @staticmethod
+    def validate_chunks(chunks: Iterable[pd.DataFrame],
+                        spill_folder: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """
+        Run validate_final on each result chunk as it passes through.
+
+        validate_final only sees duplicates within a chunk. With a
+        `spill_folder`, every chunk's grain also goes to a
+        SpilledDuplicateDetector, checked once the last chunk has passed,
+        so FINAL_GRAIN is unique across the whole result in bounded memory.
+        Raises ValidationError on the first chunk that fails, or at the end
+        for an empty result or duplicates across chunks.
+        """
+        detector = None
+        if spill_folder is not None:
+            detector = SpilledDuplicateDetector(
+                DataValidator.FINAL_GRAIN, spill_folder, Config.SPILL_PARTITIONS
+            )
+        try:
+            rows = 0
+            for chunk in chunks:
+                if not DataValidator.validate_final(chunk):
+                    raise ValidationError("Validation found issues in final output chunk")
+                if detector is not None:
+                    detector.add(chunk)
+                rows += len(chunk)
+                yield chunk
+
+            # No chunk at all: fail like an empty eager result
+            if rows == 0 and not DataValidator.validate_final(pd.DataFrame(columns=Config.OUTPUT_COLUMNS)):
+                raise ValidationError("Validation found issues in final output")
+
+            if detector is not None:
+                duplicates, rows = detector.finish()
+                if duplicates:
+                    logger.error("VALIDATION FAILED:")
+                    logger.error(
+                        f"  - {duplicates} Duplicate rows detected {DataValidator.FINAL_GRAIN} "
+                        f"across chunks, e.g. output rows {rows}"
+                    )
+                    raise ValidationError("Validation found duplicate grain keys across output chunks")
+                logger.info(
+                    f"Grain unique across all {detector.rows} rows "
+                    f"({detector.partitions} spill partitions)"
+                )
+        finally:
+            if detector is not None:
+                detector.close()
+
 
 
 # ============================================================================
@@ -421,6 +2766,72 @@ class OutputWriter:
             logger.error(f"[ERROR] Failed to write output: {str(e)}")
             return False
 
+    def write_chunks(self, chunks: Iterable[pd.DataFrame], filename: str, columns: List[str]) -> bool:
+        """
+        Write DataFrame chunks to one Excel file as they arrive.
+
+        Uses openpyxl's write-only mode, which streams rows to disk, so only
+        the current chunk is held in memory. Only writing errors return
+        False; errors raised while producing `chunks` (reading, aggregation,
+        ValidationError) are passed on to the caller and nothing is saved.
+        """
+        ws = None
+        try:
+            try:
+                self.output_folder.mkdir(parents=True, exist_ok=True)
+                output_path = self.output_folder / filename
+
+                logger.info("=" * 70)
+                logger.info("WRITING OUTPUT (STREAMING)")
+                logger.info("=" * 70)
+                logger.info(f"Output file: {output_path}")
+
+                wb = Workbook(write_only=True)
+                ws = wb.create_sheet('Aggregated Data')
+
+                # Same plain header style as write()
+                header = []
+                for col in columns:
+                    cell = WriteOnlyCell(ws, value=col)
+                    cell.font = Font(bold=False)
+                    cell.alignment = Alignment(horizontal='left', vertical='bottom')
+                    header.append(cell)
+                ws.append(header)
+            except Exception as e:
+                return self._write_failed(e)
+
+            rows = 0
+            for chunk in chunks:
+                try:
+                    # openpyxl writes None as an empty cell, like to_excel does for NA
+                    values = chunk[columns].astype(object).where(chunk[columns].notna(), None)
+                    for row in values.itertuples(index=False, name=None):
+                        ws.append(row)
+                except Exception as e:
+                    return self._write_failed(e)
+                rows += len(chunk)
+
+            try:
+                wb.save(output_path)
+            except Exception as e:
+                return self._write_failed(e)
+
+            logger.info(f"Successfully wrote {rows} rows to {output_path}")
+            logger.info("=" * 70)
+            logger.info("")
+            
+            return True
+
+        finally:
+            # An unsaved write-only sheet still has its row writer open
+            if ws is not None and not ws.closed:
+                ws.close()
+
+    @staticmethod
+    def _write_failed(error: Exception) -> bool:
+        logger.error(f"[ERROR] Failed to write output: {str(error)}")
+        return False
+
 # ============================================================================
 # Main Pipeline
 # ============================================================================
@@ -428,6 +2839,7 @@ class OutputWriter:
 def main():
     """Execute the complete aggregation pipeline."""
     
+    setup_logging()
     logger.info("")
     logger.info("=" * 70)
     logger.info("MATERIAL DATA AGGREGATION")
@@ -436,29 +2848,113 @@ def main():
     logger.info("")
     
     try:
+        if Config.TRACK_MEMORY:
+            tracemalloc.start()
+
         # Load all input files
-        loader = DataLoader(Config.INPUT_FOLDER)
-        dataframes, success = loader.load_all(Config.INPUT_FILES)
+        cache = ParsedFileCache(Config.CACHE_FOLDER, Config.CACHE_MAX_BYTES)
+        if not cache.available():
+            logger.warning("pyarrow not installed, parsed input cache disabled")
+            cache = None
+        dimension_cache = MaterialDimensionCache(Config.CACHE_FOLDER) if cache is not None else None
+
+        if Config.EXPLAIN_PLAN:
+            LazyAggregation(Config.INPUT_FOLDER, schemas=Config.INPUT_SCHEMAS).explain()
+
+        loader = DataLoader(
+            Config.INPUT_FOLDER,
+            max_workers=Config.LOAD_WORKERS or min(len(Config.INPUT_FILES), os.cpu_count() or 1),
+            cache=cache,
+            columns=MaterialDataAggregator.required_columns(),
+            schemas=Config.INPUT_SCHEMAS
+        )
+        use_sqlite = Config.AGGREGATION_BACKEND == 'sqlite'
+        file_mapping = dict(Config.INPUT_FILES)
+        if Config.CHUNKED_AGGREGATION or use_sqlite:
+            # Storage is streamed in chunks below instead of loaded whole
+            file_mapping.pop('storage')
+        with memory_step("load"):
+            dataframes, success = loader.load_all(file_mapping)
         
         if not success:
             logger.error("[ERROR] Failed to load all required files")
             return False
         
-        DataValidator.validate_sources(dataframes)
-        # Aggregate the data
-        aggregator = MaterialDataAggregator(dataframes)
-        result_df = aggregator.aggregate()
-        
+        with memory_step("validate sources"):
+            DataValidator.validate_sources(dataframes, Config.VALIDATION_WORKERS)
+        writer = OutputWriter(Config.OUTPUT_FOLDER)
 
-        if not DataValidator.validate_final(result_df):
-            logger.ERROR("Validation found issues in final output, aborting...")
-            return False
+        if use_sqlite:
+            storage_chunks = loader.iter_batches(
+                Config.INPUT_FILES['storage'],
+                schema=Config.INPUT_SCHEMAS.get('storage')
+            )
+            backend = SQLiteAggregator(Config.SQLITE_DATABASE)
+            try:
+                for name, df in dataframes.items():
+                    backend.load_table(name, [df])
+                backend.load_table('storage', storage_chunks)
 
-        # Write the output
-        writer = OutputWriter(Config.OUTPUT_FOLDER)
-        if not writer.write(result_df, Config.OUTPUT_FILENAME):
-            logger.error("[ERROR] Failed to write output file")
-            return False
+                result_chunks = DataValidator.validate_chunks(backend.aggregate_batches(), Config.SPILL_FOLDER)
+                written = writer.write_chunks(result_chunks, Config.OUTPUT_FILENAME, Config.OUTPUT_COLUMNS)
+            except ValidationError as e:
+                logger.error(f"[ERROR] {e}, aborting...")
+                return False
+            finally:
+                backend.close()
+
+            if not written:
+                logger.error("[ERROR] Failed to write output file")
+                return False
+        elif Config.CHUNKED_AGGREGATION:
+            # Aggregate the data
+            aggregator = MaterialDataAggregator(dataframes, dimension_cache=dimension_cache)
+            storage_chunks = loader.iter_batches(
+                Config.INPUT_FILES['storage'],
+                schema=Config.INPUT_SCHEMAS.get('storage')
+            )
+            result_chunks = DataValidator.validate_chunks(
+                aggregator.aggregate_chunks(storage_chunks), Config.SPILL_FOLDER
+            )
+
+            # Aggregation runs lazily while the writer consumes the chunks
+            try:
+                written = writer.write_chunks(result_chunks, Config.OUTPUT_FILENAME, Config.OUTPUT_COLUMNS)
+            except ValidationError as e:
+                logger.error(f"[ERROR] {e}, aborting...")
+                return False
+            if not written:
+                logger.error("[ERROR] Failed to write output file")
+                return False
+            DataValidator.validate_references(aggregator.references)
+        else:
+            # Aggregate the data
+            aggregator = MaterialDataAggregator(dataframes, dimension_cache=dimension_cache)
+            incremental = IncrementalAggregator(Config.STATE_FOLDER) if Config.INCREMENTAL_AGGREGATION else None
+            with memory_step("aggregate"):
+                if incremental is not None:
+                    result_df = incremental.aggregate(aggregator, Config.AGGREGATION_WORKERS)
+                elif Config.AGGREGATION_WORKERS > 1:
+                    result_df = aggregator.aggregate_partitioned(Config.AGGREGATION_WORKERS)
+                else:
+                    result_df = aggregator.aggregate()
+
+            with memory_step("validate output"):
+                DataValidator.validate_references(aggregator.references)
+                valid = DataValidator.validate_final(result_df)
+            if not valid:
+                logger.ERROR("Validation found issues in final output, aborting...")
+                return False
+
+            # Write the output
+            with memory_step("write"):
+                written = writer.write(result_df, Config.OUTPUT_FILENAME)
+            if not written:
+                logger.error("[ERROR] Failed to write output file")
+                return False
+
+            if incremental is not None:
+                incremental.save(aggregator.sources, result_df)
         
         logger.info("")
         logger.info("=" * 70)
@@ -0,0 +1,71 @@
+"""Chunked aggregation must give the same result as the eager one."""
+
+import shutil
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+DATA = Path(__file__).resolve().parent.parent / "data"
+
+
+def mixed_type_inputs(tmp_path: Path) -> Path:
+    """Copy of the inputs whose StorageBin cells are numbers in the first rows."""
+    folder = tmp_path / "data"
+    shutil.copytree(DATA, folder)
+    storage = pd.read_excel(folder / "storage.xlsx", dtype=object)
+    storage.loc[:149, 'StorageBin'] = list(range(150))
+    storage.to_excel(folder / "storage.xlsx", index=False)
+    return folder
+
+
+def eager_result(folder: Path) -> pd.DataFrame:
+    loader = main.DataLoader(folder, schemas=main.Config.INPUT_SCHEMAS)
+    dataframes, success = loader.load_all(main.Config.INPUT_FILES)
+    assert success
+    return main.MaterialDataAggregator(dataframes).aggregate()
+
+
+def chunked_result(folder: Path, batch_size: int) -> pd.DataFrame:
+    loader = main.DataLoader(folder, schemas=main.Config.INPUT_SCHEMAS)
+    file_mapping = dict(main.Config.INPUT_FILES)
+    file_mapping.pop('storage')
+    dataframes, success = loader.load_all(file_mapping)
+    assert success
+    chunks = loader.iter_batches(
+        main.Config.INPUT_FILES['storage'], batch_size, main.Config.INPUT_SCHEMAS['storage']
+    )
+    aggregator = main.MaterialDataAggregator(dataframes)
+    return pd.concat(aggregator.aggregate_chunks(chunks), ignore_index=True)
+
+
+def test_chunked_equals_eager_on_mixed_type_sheet(tmp_path):
+    folder = mixed_type_inputs(tmp_path)
+    eager = eager_result(folder)
+    chunked = chunked_result(folder, batch_size=100)
+
+    assert eager.loc[0, 'StorageBin'] == '0'
+    pd.testing.assert_frame_equal(chunked, eager, check_dtype=False)
+    # Same Python types cell by cell, e.g. no 0 where eager has '0'
+    assert (chunked.apply(lambda col: col.map(type)) == eager.apply(lambda col: col.map(type))).all().all()
+
+
+def test_spilled_duplicates_match_across_inferred_types(tmp_path):
+    grain = main.DataValidator.FINAL_GRAIN
+    chunks = [
+        pd.DataFrame({'MaterialReference': ['M1', 'M2'], 'Plant': ['0010', '0010'],
+                      'StorageLocation': ['L1', 'L1'], 'StorageBin': [1, 2]}),
+        pd.DataFrame({'MaterialReference': ['M1', 'M3'], 'Plant': ['0010', '0010'],
+                      'StorageLocation': ['L1', 'L1'], 'StorageBin': ['1', '3']}),
+    ]
+    detector = main.SpilledDuplicateDetector(grain, str(tmp_path), partitions=4)
+    try:
+        for chunk in chunks:
+            detector.add(chunk)
+        assert detector.finish() == (2, [0, 2])
+    finally:
+        detector.close()